@@ -4,21 +4,44 @@ import os
 import sys
 import time
 import json
+import argparse
+import hashlib
 import logging
 import threading
-from datetime import date, datetime
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+import itertools
+import sqlite3
+import zlib
+import base64
+import heapq
+import queue
+import statistics
+import random
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeout
+from collections import deque
+from datetime import date, datetime, timezone
 import calendar
-from decimal import Decimal
-from dataclasses import dataclass, field
-from typing import List, Tuple, Optional, Dict, Any
+from decimal import Decimal, ROUND_HALF_UP
+from dataclasses import dataclass, field, asdict
+from typing import List, Tuple, Optional, Dict, Any, Iterator
 import html
 import re
+import shutil
+import fnmatch
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from lxml import etree
 
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 
@@ -27,6 +50,9 @@ from tkinter import messagebox
 
 from googleapiclient.http import MediaFileUpload
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google.auth.exceptions import TransportError
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -40,6 +66,18 @@ BASE_URL = "https://superlogica.siscobra.com.br/servlet/awsassessoria"
 SOAP_ACTION = "WSAssessoria.Execute"
 FORMA_NEGOCIACAO_ALVO = "30% HO"
 
+# colunas comuns a todas as formas de negociação
+COLUNA_NOME_TERCEIRO = "Q"
+COLUNA_CPF_TERCEIRO = "R"
+ULTIMA_COLUNA_BASE = "T"   # CPF da planilha
+
+# limites compartilhados por todas as planilhas processadas na mesma execução
+SOAP_MAX_SIMULTANEAS = 4            # chamadas simultâneas ao Siscobra
+LINHAS_SIMULTANEAS = 4              # linhas em paralelo por planilha (padrão; "linhas_simultaneas" no ids-google.json)
+SHEETS_LEITURAS_POR_MINUTO = 55     # cota do Sheets: 60/min por usuário
+SHEETS_ESCRITAS_POR_MINUTO = 55
+DRIVE_CHAMADAS_POR_MINUTO = 600
+
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
     "https://www.googleapis.com/auth/drive.file",
@@ -65,6 +103,12 @@ CREDENTIALS_FILE = os.path.join(APP_DIR, "credentials.json")
 TOKEN_FILE = os.path.join(APP_DIR, "token.json")
 IDS_FILE = os.path.join(APP_DIR, "ids-google.json")
 LOG_FILE = os.path.join(APP_DIR, "logs.txt")
+ESTADO_PROPOSTAS_FILE = os.path.join(APP_DIR, "estado-propostas.jsonl")
+HISTORICO_CONTRATOS_FILE = os.path.join(APP_DIR, "historico-contratos.json")
+CAPTURAS_DIR = os.path.join(APP_DIR, "capturas")
+LEITURAS_DIR = os.path.join(APP_DIR, "leituras")
+FALHAS_LINHAS_FILE = os.path.join(APP_DIR, "falhas-linhas.json")
+SAIDA_GOOGLE_DIR = os.path.join(APP_DIR, "saida-google")   # não fica em PDF_DIR: sobrevive à limpeza
 
 # Dados fixos do cabeçalho
 EMPRESA_NOME = "BERNARTT & BERNARTT"
@@ -72,20 +116,13 @@ EMPRESA_ENDERECO = "Endereco: R. JOAO PALOMEQUE, NOVO MUNDO, CURITIBA, PR"
 EMPRESA_CNPJ = "CNPJ: 07.669.409/0001-44"
 EMPRESA_CONTATO = "Contato: (41) 99226-6332"
 
-# ==========================================================
-# IDS (carregados do ids-google.json)
-# ==========================================================
-SPREADSHEET_ID: str = ""
-SHEET_NAME: str = ""
-DRIVE_FOLDER_ID: str = ""
-
 # ==========================================================
 # LOG
 # ==========================================================
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s",
     handlers=[
         logging.FileHandler(LOG_FILE, encoding="utf-8"),
         logging.StreamHandler(sys.stdout),
@@ -101,6 +138,19 @@ def log_error(msg: str): logging.error(f"ERRO - {msg}")
 # ==========================================================
 
 def carregar_ids_google() -> dict:
+    """
+    Lê o ids-google.json. Aceita uma planilha só (formato antigo) ou várias em "alvos":
+
+        {
+          "formas_negociacao": [...],          (opcional, vale para todos os alvos)
+          "alvos": [
+            {"spreadsheet_id": "...", "sheet_name": "Base ADM", "drive_folder_id": "..."},
+            {"spreadsheet_id": "...", "sheet_name": "Outra aba", "drive_folder_id": "..."}
+          ]
+        }
+
+    Cada alvo pode repetir qualquer campo do nível de cima para sobrescrevê-lo.
+    """
     if not os.path.exists(IDS_FILE):
         raise FileNotFoundError(
             f"Arquivo ids-google.json não encontrado em:\n{IDS_FILE}\n\n"
@@ -111,18 +161,104 @@ def carregar_ids_google() -> dict:
     with open(IDS_FILE, "r", encoding="utf-8") as f:
         data = json.load(f)
 
-    for k in ("spreadsheet_id", "sheet_name", "drive_folder_id"):
-        if not data.get(k):
-            raise ValueError(f"Campo obrigatório ausente em ids-google.json: {k}")
+    if isinstance(data, list):
+        data = {"alvos": data}
+
+    alvos = data.get("alvos")
+    if alvos is None:
+        alvos = [{}]
+    if not isinstance(alvos, list) or not alvos:
+        raise ValueError("ids-google.json: \"alvos\" deve ser uma lista com pelo menos uma planilha")
+
+    comum = {k: v for k, v in data.items() if k != "alvos"}
+    data["alvos"] = [{**comum, **a} for a in alvos]
+
+    for i, alvo in enumerate(data["alvos"], start=1):
+        for k in ("spreadsheet_id", "sheet_name", "drive_folder_id"):
+            if not alvo.get(k):
+                sufixo = f" (alvo {i})" if len(alvos) > 1 else ""
+                raise ValueError(f"Campo obrigatório ausente em ids-google.json: {k}{sufixo}")
 
     return data
 
-def carregar_ids_para_globais():
-    global SPREADSHEET_ID, SHEET_NAME, DRIVE_FOLDER_ID
+def carregar_formas_negociacao(data: dict) -> List["FormaAlvo"]:
+    """
+    Lê "formas_negociacao" (opcional) do ids-google.json. Sem o campo, usa só "30% HO"
+    nas colunas de sempre (E, O, P). Exemplo com duas formas:
+
+        "formas_negociacao": [
+            "30% HO",
+            {"nome": "20% HO", "coluna_link": "U", "coluna_valor": "V", "coluna_vencimentos": "W"}
+        ]
+
+    A primeira forma usa E/O/P por padrão; as demais precisam das três colunas.
+    Nome do terceiro (Q) e CPF (R) são comuns a todas.
+    """
+    brutas = data.get("formas_negociacao") or [FORMA_NEGOCIACAO_ALVO]
+    if not isinstance(brutas, list):
+        raise ValueError("ids-google.json: formas_negociacao deve ser uma lista")
+
+    formas: List[FormaAlvo] = []
+    for i, item in enumerate(brutas):
+        if isinstance(item, str):
+            item = {"nome": item}
+        nome = str(item.get("nome") or "").strip()
+        if not nome:
+            raise ValueError("ids-google.json: item de formas_negociacao sem 'nome'")
+
+        if i == 0:
+            forma = FormaAlvo(
+                nome=nome,
+                coluna_link=str(item.get("coluna_link") or "E").strip().upper(),
+                coluna_valor=str(item.get("coluna_valor") or "O").strip().upper(),
+                coluna_vencimentos=str(item.get("coluna_vencimentos") or "P").strip().upper(),
+            )
+        else:
+            faltando = [k for k in ("coluna_link", "coluna_valor", "coluna_vencimentos") if not item.get(k)]
+            if faltando:
+                raise ValueError(
+                    f"ids-google.json: informe {', '.join(faltando)} para a forma de negociação '{nome}'"
+                )
+            forma = FormaAlvo(
+                nome=nome,
+                coluna_link=str(item["coluna_link"]).strip().upper(),
+                coluna_valor=str(item["coluna_valor"]).strip().upper(),
+                coluna_vencimentos=str(item["coluna_vencimentos"]).strip().upper(),
+            )
+        formas.append(forma)
+
+    usadas = [COLUNA_NOME_TERCEIRO, COLUNA_CPF_TERCEIRO]
+    for f in formas:
+        for col in (f.coluna_link, f.coluna_valor, f.coluna_vencimentos):
+            if not re.fullmatch(r"[A-Z]{1,2}", col):
+                raise ValueError(f"ids-google.json: coluna inválida '{col}' na forma '{f.nome}'")
+            if col in usadas:
+                raise ValueError(f"ids-google.json: coluna {col} usada mais de uma vez (forma '{f.nome}')")
+            usadas.append(col)
+
+    return formas
+
+def carregar_alvos() -> List["AlvoPlanilha"]:
+    """Um AlvoPlanilha (planilha + aba + pasta do Drive) por item de "alvos" do ids-google.json."""
     data = carregar_ids_google()
-    SPREADSHEET_ID = str(data["spreadsheet_id"]).strip()
-    SHEET_NAME = str(data["sheet_name"]).strip()
-    DRIVE_FOLDER_ID = str(data["drive_folder_id"]).strip()
+    alvos: List[AlvoPlanilha] = []
+    for i, item in enumerate(data["alvos"], start=1):
+        alvo = AlvoPlanilha(
+            indice=i,
+            spreadsheet_id=str(item["spreadsheet_id"]).strip(),
+            sheet_name=str(item["sheet_name"]).strip(),
+            drive_folder_id=str(item["drive_folder_id"]).strip(),
+            formas=carregar_formas_negociacao(item),
+            nome=str(item.get("nome") or "").strip(),
+            linhas_simultaneas=max(1, int(item.get("linhas_simultaneas") or LINHAS_SIMULTANEAS)),
+        )
+        alvos.append(alvo)
+
+    chaves = [(a.spreadsheet_id, a.sheet_name) for a in alvos]
+    if len(set(chaves)) != len(chaves):
+        raise ValueError("ids-google.json: a mesma planilha/aba aparece em mais de um alvo")
+
+    return alvos
 
 # ==========================================================
 # PROGRESSO UI
@@ -135,6 +271,37 @@ PROGRESS: Dict[str, Any] = {
     "running": False,
     "last_message": "",
 }
+PROGRESS_LOCK = threading.Lock()
+
+# identifica a execução nos arquivos gerados (captura SOAP, perfil)
+RUN_ID: str = ""
+
+def novo_run_id() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+def incrementar_progresso(chave: str, n: int = 1):
+    """Vários alvos rodam ao mesmo tempo: contadores do PROGRESS só mudam por aqui."""
+    with PROGRESS_LOCK:
+        PROGRESS[chave] += n
+
+# métrica de arranque: tempo do início da execução até a primeira linha processada
+INICIO_EXECUCAO: float = 0.0
+_PRIMEIRA_LINHA_REGISTRADA = False
+
+def marcar_inicio_execucao():
+    global INICIO_EXECUCAO, _PRIMEIRA_LINHA_REGISTRADA
+    with PROGRESS_LOCK:
+        INICIO_EXECUCAO = time.monotonic()
+        _PRIMEIRA_LINHA_REGISTRADA = False
+
+def registrar_primeira_linha():
+    global _PRIMEIRA_LINHA_REGISTRADA
+    with PROGRESS_LOCK:
+        if _PRIMEIRA_LINHA_REGISTRADA:
+            return
+        _PRIMEIRA_LINHA_REGISTRADA = True
+        decorrido = time.monotonic() - INICIO_EXECUCAO
+    log_info(f"Tempo até a primeira linha processada: {decorrido:.2f}s")
 
 # ==========================================================
 # CONTROLE (PAUSAR / ENCERRAR)
@@ -174,10 +341,100 @@ def check_pause_stop(on_progress: Optional[callable] = None) -> bool:
         PROGRESS["last_message"] = "Pausado"
         if on_progress:
             on_progress()
-        time.sleep(0.2)
+        PAUSE_EVENT.wait(0.2)
 
     return True
 
+# Esperas e chamadas de rede interrompíveis: Encerrar vale em até ~0,2s mesmo
+# no meio de um timeout SOAP de 60s ou de um upload. A chamada de rede roda numa
+# thread daemon; ao encerrar, ela é abandonada (termina sozinha em segundo plano
+# e não segura a saída do programa) e quem esperava recebe ExecucaoEncerrada.
+ESPERA_ENCERRAR_SEG = 0.2
+
+class ExecucaoEncerrada(Exception):
+    """Encerrar pedido durante uma espera: a linha para sem gravar ERRO."""
+
+def em_thread_daemon(fn, *args, **kwargs) -> Future:
+    futuro: Future = Future()
+
+    def rodar():
+        if not futuro.set_running_or_notify_cancel():
+            return
+        try:
+            futuro.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            futuro.set_exception(e)
+
+    threading.Thread(target=rodar, daemon=True, name=f"{threading.current_thread().name}-io").start()
+    return futuro
+
+def aguardar_futuro(futuro: Future, timeout: Optional[float] = None):
+    """futuro.result() que desiste ao Encerrar. Passado o timeout, levanta FuturesTimeout."""
+    limite = None if timeout is None else time.monotonic() + timeout
+    while True:
+        espera = ESPERA_ENCERRAR_SEG if limite is None else min(ESPERA_ENCERRAR_SEG, limite - time.monotonic())
+        if espera <= 0:
+            raise FuturesTimeout()
+        try:
+            return futuro.result(timeout=espera)
+        except FuturesTimeout:
+            if futuro.done():
+                raise  # o próprio fn levantou TimeoutError
+            if STOP_EVENT.is_set():
+                raise ExecucaoEncerrada()
+
+def executar_interrompivel(fn, *args, **kwargs):
+    return aguardar_futuro(em_thread_daemon(fn, *args, **kwargs))
+
+def executar_google(requisicao) -> Dict[str, Any]:
+    """requisicao.execute() da API Google, interrompível."""
+    return executar_interrompivel(requisicao.execute)
+
+def dormir(segundos: float):
+    """time.sleep que acorda ao Encerrar (ExecucaoEncerrada)."""
+    if STOP_EVENT.wait(segundos):
+        raise ExecucaoEncerrada()
+
+# ==========================================================
+# LIMITES DE TAXA (COMPARTILHADOS ENTRE ALVOS)
+# ==========================================================
+
+class LimitadorTaxa:
+    """Balde de fichas thread-safe: no máximo `por_minuto` chamadas por minuto, com rajadas curtas."""
+
+    def __init__(self, por_minuto: float, rajada: int = 10):
+        self.intervalo = 60.0 / por_minuto
+        self.rajada = rajada
+        self._fichas = float(rajada)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.ativo = True   # desligado no replay (Google falso)
+
+    def aguardar(self):
+        if not self.ativo:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(self.rajada, self._fichas + (agora - self._ultimo) / self.intervalo)
+                self._ultimo = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) * self.intervalo
+            with trecho("espera_cota", segundos=round(espera, 3)):
+                dormir(espera)
+
+LIMITE_SHEETS_LEITURA = LimitadorTaxa(SHEETS_LEITURAS_POR_MINUTO)
+LIMITE_SHEETS_ESCRITA = LimitadorTaxa(SHEETS_ESCRITAS_POR_MINUTO)
+LIMITE_DRIVE = LimitadorTaxa(DRIVE_CHAMADAS_POR_MINUTO, rajada=20)
+SEMAFORO_SOAP = threading.BoundedSemaphore(SOAP_MAX_SIMULTANEAS)
+
+def adquirir_vaga_soap():
+    while not SEMAFORO_SOAP.acquire(timeout=ESPERA_ENCERRAR_SEG):
+        if STOP_EVENT.is_set():
+            raise ExecucaoEncerrada()
+
 # ==========================================================
 # MODELOS
 # ==========================================================
@@ -209,6 +466,46 @@ class PropostaAcordo:
     data_calculo: str
     parcelas: List[ParcelaResumo] = field(default_factory=list)
 
+@dataclass
+class FormaAlvo:
+    """Forma de negociação a gerar e as colunas da planilha onde ela é gravada."""
+    nome: str
+    coluna_link: str = "E"
+    coluna_valor: str = "O"
+    coluna_vencimentos: str = "P"
+
+@dataclass
+class AlvoPlanilha:
+    """Uma planilha/aba a processar e a pasta do Drive onde vão os PDFs dela."""
+    indice: int
+    spreadsheet_id: str
+    sheet_name: str
+    drive_folder_id: str
+    formas: List[FormaAlvo] = field(default_factory=list)
+    nome: str = ""
+    linhas_simultaneas: int = LINHAS_SIMULTANEAS
+    simulado: bool = False   # replay: nada é gravado no estado local
+
+    @property
+    def rotulo(self) -> str:
+        return self.nome or self.sheet_name
+
+@dataclass
+class LinhaPendente:
+    numero: int
+    valores: List[str]
+    contrato: str
+    cpf_planilha: str
+    formas: List[FormaAlvo] = field(default_factory=list)
+
+    def celula(self, coluna: str) -> str:
+        idx = coluna_para_indice(coluna)
+        return (self.valores[idx] if len(self.valores) > idx else "").strip()
+
+    def com_erro(self) -> bool:
+        """Alguma forma da linha está marcada com ERRO (linha sendo refeita)."""
+        return any(self.celula(f.coluna_link).upper().startswith("ERRO") for f in self.formas)
+
 # ==========================================================
 # FUNÇÕES AUXILIARES
 # ==========================================================
@@ -264,6 +561,26 @@ def sanitize_filename(name: str) -> str:
     name = re.sub(r"\s+", " ", name)
     return name[:180].strip()
 
+def coluna_para_indice(coluna: str) -> int:
+    """'A' -> 0, 'T' -> 19, 'AA' -> 26"""
+    n = 0
+    for ch in coluna.strip().upper():
+        n = n * 26 + (ord(ch) - ord("A") + 1)
+    return n - 1
+
+def indice_para_coluna(idx: int) -> str:
+    """0 -> 'A', 26 -> 'AA'"""
+    col = ""
+    idx += 1
+    while idx:
+        idx, r = divmod(idx - 1, 26)
+        col = chr(ord("A") + r) + col
+    return col
+
+def gsheet_texto_literal(valor: str) -> str:
+    """Valor que deve ficar como texto mesmo gravado com USER_ENTERED (o ' não aparece)."""
+    return f"'{valor}" if valor and not valor.startswith("'") else valor
+
 def gsheet_escape_quotes(s: str) -> str:
     return (s or "").replace('"', '""').replace("\n", " ").replace("\r", " ").strip()
 
@@ -296,6 +613,40 @@ def resumir_erro_usuario(e: Exception) -> str:
         msg = msg[:160] + "..."
     return msg
 
+GOOGLE_STATUS_TRANSITORIOS = {429, 500, 502, 503, 504}
+GOOGLE_MOTIVOS_COTA = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded", "backendError")
+
+def google_indisponivel(e: BaseException) -> bool:
+    """Falha do Google que passa sozinha (fora do ar, cota, rede): não é problema da linha."""
+    if isinstance(e, HttpError):
+        status = getattr(e.resp, "status", 0)
+        if status in GOOGLE_STATUS_TRANSITORIOS:
+            return True
+        return status == 403 and any(m in str(e) for m in GOOGLE_MOTIVOS_COTA)
+    return isinstance(e, (ConnectionError, TimeoutError, TransportError, httplib2.HttpLib2Error))
+
+def erro_transitorio(e: Optional[BaseException]) -> bool:
+    """Timeout, rede, cota ou servidor fora do ar (SOAP ou Google): vale tentar de novo mais tarde."""
+    while e is not None:
+        if google_indisponivel(e):
+            return True
+        if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            return e.response.status_code >= 500 or e.response.status_code == 429
+        e = e.__cause__   # chamar_ws_com_retry: RuntimeError "from" a última falha
+    return False
+
+def env_ativo(nome: str) -> bool:
+    """Variável de ambiente ligada: 1, true, sim."""
+    return os.environ.get(nome, "").strip().lower() in ("1", "true", "sim")
+
+def env_int(nome: str, padrao: int) -> int:
+    try:
+        return int(os.environ.get(nome, "").strip() or padrao)
+    except ValueError:
+        return padrao
+
 def sufixo_contrato(contrato: str) -> str:
     """
     Retorna o que vem depois do '-' no contrato.
@@ -402,7 +753,8 @@ def valor_por_extenso_ptbr(valor: Decimal) -> str:
 # GOOGLE
 # ==========================================================
 
-def criar_servicos_google():
+def obter_credenciais_google() -> Credentials:
+    """Carrega/renova o token.json (ou abre o navegador). Uma vez por execução, compartilhado por todos os alvos."""
     if not os.path.exists(CREDENTIALS_FILE):
         raise FileNotFoundError(
             f"credentials.json não encontrado em:\n{CREDENTIALS_FILE}\n\n"
@@ -427,124 +779,622 @@ def criar_servicos_google():
             flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
             creds = flow.run_local_server(port=0)
 
-        with open(TOKEN_FILE, "w", encoding="utf-8") as f:
-            f.write(creds.to_json())
+        salvar_token(creds)
+
+    return creds
+
+def salvar_token(creds: Credentials):
+    tmp = TOKEN_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(creds.to_json())
+    os.replace(tmp, TOKEN_FILE)
+
+def criar_servicos_google(creds: Optional[Credentials] = None):
+    """
+    Cria os clientes Sheets e Drive. O httplib2 por baixo não é thread-safe,
+    então cada alvo (thread) cria os seus a partir das mesmas credenciais.
+    """
+    if creds is None:
+        creds = obter_credenciais_google()
 
     sheets_service = build("sheets", "v4", credentials=creds)
     drive_service = build("drive", "v3", credentials=creds)
     log_info("Serviços Google Sheets e Drive criados.")
     return sheets_service, drive_service
 
-def ler_linhas_pendentes(sheets_service) -> List[Tuple[int, List[str], str, str]]:
-    log_info("Lendo planilha Base ADM...")
-    range_ = f"{SHEET_NAME}!A2:T"
+class PoolClientesGoogle:
+    """
+    Clientes Sheets/Drive por thread, todos sobre as mesmas Credentials.
+    Cada thread ganha os seus (e o seu transporte httplib2) na primeira chamada
+    de servicos(). Uma thread de fundo renova o token antes de expirar, para
+    nenhuma chamada parar no meio da execução esperando a renovação.
+    """
+    RENOVAR_ANTES_SEG = 10 * 60
+    REAVALIAR_SEG = 5 * 60
+
+    def __init__(self, creds: Credentials):
+        self.creds = creds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def servicos(self):
+        sv = getattr(self._local, "servicos", None)
+        if sv is None:
+            sv = criar_servicos_google(self.creds)
+            self._local.servicos = sv
+        return sv
+
+    def _segundos_ate_renovar(self) -> float:
+        expiry = getattr(self.creds, "expiry", None)   # datetime UTC sem fuso
+        if expiry is None:
+            return float(self.REAVALIAR_SEG)
+        agora = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (expiry - agora).total_seconds() - self.RENOVAR_ANTES_SEG
+
+    def renovar_token(self):
+        with self._lock:
+            self.creds.refresh(Request())
+            salvar_token(self.creds)
+        log_info(f"Token do Google renovado antes de expirar (novo vencimento: {self.creds.expiry:%H:%M:%S} UTC).")
+
+    def _loop_renovacao(self):
+        while not self._parar.is_set():
+            espera = self._segundos_ate_renovar()
+            if espera > 0:
+                if self._parar.wait(min(espera, self.REAVALIAR_SEG)):
+                    return
+                continue
+            try:
+                self.renovar_token()
+            except Exception as e:
+                log_warn(f"Falha ao renovar token do Google (nova tentativa em 30s): {e}")
+                if self._parar.wait(30):
+                    return
+
+    def iniciar(self) -> "PoolClientesGoogle":
+        if getattr(self.creds, "refresh_token", None) and self._thread is None:
+            self._thread = threading.Thread(target=self._loop_renovacao, name="renova-token", daemon=True)
+            self._thread.start()
+        return self
+
+    def fechar(self):
+        self._parar.set()
+
+def link_preenchido(valor: str) -> bool:
+    """Coluna E com link de verdade (ignora vazio e marcações de ERRO)."""
+    v = (valor or "").strip()
+    return bool(v) and not v.upper().startswith("ERRO")
+
+def ultima_coluna_leitura(alvo: AlvoPlanilha) -> str:
+    cols = [ULTIMA_COLUNA_BASE] + [f.coluna_link for f in alvo.formas]
+    return indice_para_coluna(max(coluna_para_indice(c) for c in cols))
+
+# Leitura incremental: antes de baixar a aba, pergunta ao Drive a versão da
+# planilha (files().get, fields=version,modifiedTime). Se for a mesma da última
+# leitura, usa o retrato salvo em APP_DIR/leituras e não baixa nada. Se mudou,
+# baixa só as colunas que o robô usa (A, C, T e os links das formas), começando
+# pelas últimas LEITURA_BLOCO_LINHAS linhas conhecidas (onde entram as novas).
+LEITURA_BLOCO_LINHAS = 500
+
+def colunas_lidas(alvo: AlvoPlanilha) -> List[str]:
+    cols = {"A", "C", ULTIMA_COLUNA_BASE} | {f.coluna_link for f in alvo.formas}
+    return sorted(cols, key=coluna_para_indice)
+
+def caminho_retrato_leitura(alvo: AlvoPlanilha) -> str:
+    chave = hashlib.sha1(f"{alvo.spreadsheet_id}|{alvo.sheet_name}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(LEITURAS_DIR, f"leitura-{chave}.json")
+
+def versao_planilha(drive_service, alvo: AlvoPlanilha) -> Optional[str]:
+    """version|modifiedTime do arquivo no Drive, ou None se não der para consultar."""
+    try:
+        LIMITE_DRIVE.aguardar()
+        meta = executar_google(drive_service.files().get(
+            fileId=alvo.spreadsheet_id,
+            fields="version,modifiedTime"
+        ))
+    except ExecucaoEncerrada:
+        raise
+    except Exception as e:
+        log_warn(f"[{alvo.rotulo}] Não consegui consultar a versão da planilha no Drive ({e}); lendo tudo.")
+        return None
+    if not meta.get("version"):
+        return None
+    return f"{meta.get('version')}|{meta.get('modifiedTime', '')}"
 
-    resp = sheets_service.spreadsheets().values().get(
-        spreadsheetId=SPREADSHEET_ID,
-        range=range_
-    ).execute()
+def carregar_retrato_leitura(caminho: str) -> Optional[Dict[str, Any]]:
+    try:
+        if os.path.exists(caminho):
+            with open(caminho, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        log_warn(f"Retrato da última leitura ignorado (arquivo inválido): {e}")
+    return None
 
-    values = resp.get("values", [])
-    pendentes: List[Tuple[int, List[str], str, str]] = []
+def salvar_retrato_leitura(caminho: str, retrato: Dict[str, Any]):
+    try:
+        os.makedirs(LEITURAS_DIR, exist_ok=True)
+        tmp = caminho + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(retrato, f, ensure_ascii=False)
+        os.replace(tmp, caminho)
+    except Exception as e:
+        log_warn(f"Não consegui salvar o retrato da leitura: {e}")
+
+def baixar_colunas(sheets_service, alvo: AlvoPlanilha, cols: List[str],
+                   primeira: int = 2, ultima: Optional[int] = None) -> Dict[str, List[str]]:
+    """
+    Uma chamada values.batchGet com um intervalo por coluna, da linha primeira
+    até ultima (sem ultima, até o fim da aba).
+    """
+    fim = str(ultima) if ultima else ""
+    LIMITE_SHEETS_LEITURA.aguardar()
+    resp = executar_google(sheets_service.spreadsheets().values().batchGet(
+        spreadsheetId=alvo.spreadsheet_id,
+        ranges=[f"{alvo.sheet_name}!{c}{primeira}:{c}{fim}" for c in cols],
+        majorDimension="COLUMNS"
+    ))
+
+    colunas: Dict[str, List[str]] = {}
+    for col, vr in zip(cols, resp.get("valueRanges", [])):
+        vals = vr.get("values") or [[]]
+        colunas[col] = [str(v) for v in vals[0]]
+    total = max((len(v) for v in colunas.values()), default=0)
+    if ultima:
+        total = ultima - primeira + 1
+    for col in cols:
+        vals = colunas.setdefault(col, [])
+        vals.extend([""] * (total - len(vals)))
+    return colunas
+
+def _montar_linhas(colunas: Dict[str, List[str]], largura: int) -> List[List[str]]:
+    total = max((len(v) for v in colunas.values()), default=0)
+    linhas = [[""] * largura for _ in range(total)]
+    for col, vals in colunas.items():
+        i = coluna_para_indice(col)
+        for n, v in enumerate(vals):
+            linhas[n][i] = v
+    return linhas
+
+def ler_valores_em_blocos(sheets_service, alvo: AlvoPlanilha, drive_service=None,
+                          silencioso: bool = False) -> Iterator[Tuple[int, List[List[str]]]]:
+    """
+    Linhas da aba como (número da primeira linha, linhas), com as colunas de
+    colunas_lidas preenchidas (as demais ficam vazias). Sem drive_service não
+    há retrato. Com retrato e planilha alterada, baixa primeiro as últimas
+    LEITURA_BLOCO_LINHAS linhas conhecidas até o fim da aba (onde entram as
+    linhas novas) e depois o resto, para o processamento começar antes.
+    """
+    cols = colunas_lidas(alvo)
+    largura = coluna_para_indice(ultima_coluna_leitura(alvo)) + 1
+    caminho = caminho_retrato_leitura(alvo)
+    versao = versao_planilha(drive_service, alvo) if drive_service is not None else None
+    anterior = carregar_retrato_leitura(caminho) if versao else None
+    if anterior and anterior.get("colunas_lidas") != cols:
+        anterior = None  # mudou a configuração das formas: retrato não serve
+
+    if anterior and anterior.get("versao") == versao:
+        if not silencioso:
+            log_info(f"[{alvo.rotulo}] Planilha sem alterações desde a última leitura; download pulado.")
+        yield 2, _montar_linhas(anterior["colunas"], largura)
+        return
 
-    for idx, row in enumerate(values, start=2):
+    total_anterior = max((len(v) for v in anterior["colunas"].values()), default=0) if anterior else 0
+    inicio_cauda = 2 + max(0, total_anterior - LEITURA_BLOCO_LINHAS)
+    if inicio_cauda > 2:
+        cauda = baixar_colunas(sheets_service, alvo, cols, inicio_cauda)
+        yield inicio_cauda, _montar_linhas(cauda, largura)
+        corpo = baixar_colunas(sheets_service, alvo, cols, 2, inicio_cauda - 1)
+        yield 2, _montar_linhas(corpo, largura)
+        colunas = {c: corpo[c] + cauda[c] for c in cols}
+    else:
+        colunas = baixar_colunas(sheets_service, alvo, cols)
+        yield 2, _montar_linhas(colunas, largura)
+
+    if versao:
+        salvar_retrato_leitura(caminho, {
+            "versao": versao,
+            "colunas_lidas": cols,
+            "colunas": colunas,
+        })
+
+def _pendentes_do_bloco(alvo: AlvoPlanilha, primeira: int, values: List[List[str]],
+                        incluir_vinculadas: bool,
+                        refazer: Optional[Dict[int, str]] = None) -> List[LinhaPendente]:
+    pendentes: List[LinhaPendente] = []
+    for idx, row in enumerate(values, start=primeira):
         id_linha = (row[0] if len(row) > 0 else "").strip()         # A
-        link_planilha = (row[4] if len(row) > 4 else "").strip()    # E
         contrato = (row[2] if len(row) > 2 else "").strip()         # C
         cpf_planilha = (row[19] if len(row) > 19 else "").strip()   # T
 
-        if link_planilha:
-            continue
         if not id_linha or id_linha == "-":
             continue
         if not contrato or contrato == "-":
             continue
 
-        pendentes.append((idx, row, contrato, cpf_planilha))
+        linha = LinhaPendente(numero=idx, valores=row, contrato=contrato, cpf_planilha=cpf_planilha)
+        # ERRO de falha transitória registrada para este contrato: a forma volta a ser pendente
+        refazer_erro = bool(refazer) and refazer.get(idx) == contrato
+        for forma in alvo.formas:
+            link_planilha = linha.celula(forma.coluna_link)
+            if link_planilha and not (incluir_vinculadas and link_preenchido(link_planilha)) \
+                    and not (refazer_erro and link_planilha.upper().startswith("ERRO")):
+                continue
+            linha.formas.append(forma)
 
-    log_info(f"Encontradas {len(pendentes)} linhas pendentes (com ID e sem link).")
+        if linha.formas:
+            pendentes.append(linha)
     return pendentes
 
-def atualizar_celula(sheets_service, row: int, coluna: str, valor: str, user_entered: bool = False):
-    range_ = f"{SHEET_NAME}!{coluna}{row}"
-    body = {"values": [[valor]]}
-    sheets_service.spreadsheets().values().update(
-        spreadsheetId=SPREADSHEET_ID,
-        range=range_,
-        valueInputOption=("USER_ENTERED" if user_entered else "RAW"),
-        body=body
-    ).execute()
-
-def upload_pdf_para_drive(drive_service, caminho_pdf: str, nome_arquivo: str) -> str:
+def ler_pendentes_em_blocos(sheets_service, alvo: AlvoPlanilha,
+                            incluir_vinculadas: bool = False,
+                            drive_service=None,
+                            silencioso: bool = False,
+                            refazer: Optional[Dict[int, str]] = None) -> Iterator[List[LinhaPendente]]:
+    """
+    Linhas com ID e contrato e com pelo menos uma forma de negociação sem link
+    (coluna E para a forma principal), bloco a bloco conforme a leitura chega.
+    Cada linha traz só as formas que faltam. Com incluir_vinculadas=True (modo
+    recalcular), também devolve as formas que já têm link, para conferir se a
+    proposta mudou. refazer ({linha: contrato}, FalhasLinhas.transitorias):
+    formas com ERRO nessas linhas também contam como pendentes.
+    """
+    if not silencioso:
+        log_info(f"Lendo planilha {alvo.rotulo}...")
+    total = 0
+    for primeira, values in ler_valores_em_blocos(sheets_service, alvo, drive_service, silencioso):
+        pendentes = _pendentes_do_bloco(alvo, primeira, values, incluir_vinculadas, refazer)
+        total += len(pendentes)
+        yield pendentes
+
+    if not silencioso:
+        if incluir_vinculadas:
+            log_info(f"Encontradas {total} linhas para recalcular (com ID, com ou sem link).")
+        else:
+            log_info(f"Encontradas {total} linhas pendentes (com ID e sem link).")
+
+def ler_linhas_pendentes(sheets_service, alvo: AlvoPlanilha,
+                         incluir_vinculadas: bool = False,
+                         drive_service=None,
+                         silencioso: bool = False,
+                         refazer: Optional[Dict[int, str]] = None) -> List[LinhaPendente]:
+    """ler_pendentes_em_blocos de uma vez, em ordem de linha."""
+    pendentes = [l for bloco in ler_pendentes_em_blocos(sheets_service, alvo, incluir_vinculadas,
+                                                         drive_service, silencioso, refazer)
+                 for l in bloco]
+    pendentes.sort(key=lambda l: l.numero)
+    return pendentes
+
+def atualizar_linha(sheets_service, alvo: AlvoPlanilha, row: int, valores: Dict[str, Tuple[str, bool]]):
+    """
+    Grava várias células da mesma linha numa única chamada (values.batchUpdate).
+    valores: {coluna: (valor, user_entered)}. Como o batchUpdate aceita um só
+    valueInputOption, os valores "RAW" vão como texto literal em USER_ENTERED.
+    """
+    atualizar_linhas(sheets_service, alvo, {row: valores})
+
+def atualizar_linhas(sheets_service, alvo: AlvoPlanilha, linhas: Dict[int, Dict[str, Tuple[str, bool]]]):
+    """Como atualizar_linha, para várias linhas na mesma chamada."""
+    data = []
+    for row, valores in linhas.items():
+        for coluna, (valor, user_entered) in valores.items():
+            if not user_entered:
+                valor = gsheet_texto_literal(valor)
+            data.append({"range": f"{alvo.sheet_name}!{coluna}{row}", "values": [[valor]]})
+
+    with trecho("planilha.escrita", linhas=len(linhas), celulas=len(data)) as rastro:
+        if rastro is not None:
+            rastro["bytes"] = sum(len(d["values"][0][0].encode("utf-8")) for d in data)
+        LIMITE_SHEETS_ESCRITA.aguardar()
+        executar_google(sheets_service.spreadsheets().values().batchUpdate(
+            spreadsheetId=alvo.spreadsheet_id,
+            body={"valueInputOption": "USER_ENTERED", "data": data}
+        ))
+
+def upload_pdf_para_drive(drive_service, alvo: AlvoPlanilha, caminho_pdf: str,
+                          nome_arquivo: str) -> Tuple[str, str]:
+    """Cria o PDF na pasta do Drive e libera leitura por link. Retorna (file_id, webViewLink)."""
     file_metadata = {
         "name": nome_arquivo,
         "mimeType": "application/pdf",
-        "parents": [DRIVE_FOLDER_ID],
+        "parents": [alvo.drive_folder_id],
     }
     media = MediaFileUpload(caminho_pdf, mimetype="application/pdf", resumable=False)
 
     log_info(f"Upload Drive: {nome_arquivo}")
-    file = drive_service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields="id, webViewLink"
-    ).execute()
+    with trecho("drive.upload", bytes=os.path.getsize(caminho_pdf)):
+        LIMITE_DRIVE.aguardar()
+        file = executar_google(drive_service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields="id, webViewLink"
+        ))
+    METRICAS_PDF.enviado(caminho_pdf)
 
     file_id = file["id"]
 
-    drive_service.permissions().create(
-        fileId=file_id,
-        body={"role": "reader", "type": "anyone"},
-        fields="id"
-    ).execute()
+    with trecho("drive.permissao"):
+        LIMITE_DRIVE.aguardar()
+        executar_google(drive_service.permissions().create(
+            fileId=file_id,
+            body={"role": "reader", "type": "anyone"},
+            fields="id"
+        ))
+
+    return file_id, file.get("webViewLink", "")
+
+def atualizar_pdf_no_drive(drive_service, file_id: str, caminho_pdf: str, nome_arquivo: str) -> str:
+    """
+    Substitui o conteúdo de um PDF já existente no Drive (files().update).
+    O link e a permissão de leitura continuam os mesmos.
+    """
+    media = MediaFileUpload(caminho_pdf, mimetype="application/pdf", resumable=False)
+
+    log_info(f"Atualizando no Drive: {nome_arquivo} ({file_id})")
+    with trecho("drive.atualizar", bytes=os.path.getsize(caminho_pdf)):
+        LIMITE_DRIVE.aguardar()
+        file = executar_google(drive_service.files().update(
+            fileId=file_id,
+            body={"name": nome_arquivo},
+            media_body=media,
+            fields="id, webViewLink"
+        ))
+    METRICAS_PDF.enviado(caminho_pdf)
 
     return file.get("webViewLink", "")
 
+# Índice da pasta do Drive: uma listagem paginada no início (nome, id, md5 e
+# link de cada arquivo), atualizada a cada envio. PDF idêntico (mesmo md5)
+# reaproveita o arquivo e o link; mesmo nome com conteúdo diferente atualiza
+# o arquivo existente em vez de criar outro. Evita PDFs duplicados quando uma
+# linha falha depois do upload e é processada de novo.
+INDICE_DRIVE_VALIDADE_SEG = 1800   # modo vigiar: relista a pasta depois disso
+
+def md5_arquivo(caminho: str) -> str:
+    h = hashlib.md5()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 16), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+class IndicePastaDrive:
+    """
+    Arquivos da pasta do alvo por nome, md5 e id. donos: file_id -> chave do
+    estado das propostas, para nunca sobrescrever o PDF de outro contrato que
+    por acaso tenha o mesmo nome.
+    """
+
+    def __init__(self, alvo: AlvoPlanilha, estado_propostas: Optional[Dict[str, Dict[str, str]]] = None):
+        self.alvo = alvo
+        self.por_id: Dict[str, Dict[str, str]] = {}
+        self.por_nome: Dict[str, Dict[str, str]] = {}
+        self.por_md5: Dict[str, Dict[str, str]] = {}
+        self.donos: Dict[str, str] = {
+            reg["file_id"]: chave for chave, reg in (estado_propostas or {}).items() if reg.get("file_id")
+        }
+        self.carregado_em: Optional[float] = None
+        self._lock = threading.Lock()
+        self._locks_nome: Dict[str, threading.Lock] = {}
+
+    def carregar(self, drive_service) -> "IndicePastaDrive":
+        por_id: Dict[str, Dict[str, str]] = {}
+        por_nome: Dict[str, Dict[str, str]] = {}
+        por_md5: Dict[str, Dict[str, str]] = {}
+        duplicados = 0
+        page_token = None
+        while True:
+            LIMITE_DRIVE.aguardar()
+            resp = executar_google(drive_service.files().list(
+                q=f"'{self.alvo.drive_folder_id}' in parents and trashed = false",
+                fields="nextPageToken, files(id, name, md5Checksum, webViewLink)",
+                orderBy="modifiedTime desc",
+                pageSize=1000,
+                pageToken=page_token,
+            ))
+            for f in resp.get("files", []):
+                por_id[f["id"]] = f
+                if f.get("name", "") in por_nome:
+                    duplicados += 1
+                else:
+                    por_nome[f.get("name", "")] = f   # o mais recente vence
+                if f.get("md5Checksum"):
+                    por_md5.setdefault(f["md5Checksum"], f)
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                break
+
+        with self._lock:
+            self.por_id, self.por_nome, self.por_md5 = por_id, por_nome, por_md5
+            self.carregado_em = time.monotonic()
+
+        log_info(f"[{self.alvo.rotulo}] Pasta do Drive indexada: {len(por_id)} arquivos.")
+        if duplicados:
+            log_warn(f"[{self.alvo.rotulo}] {duplicados} arquivo(s) com nome repetido na pasta do Drive.")
+        return self
+
+    def _registrar(self, f: Dict[str, str], dono: str):
+        with self._lock:
+            antigo = self.por_id.get(f["id"])
+            if antigo and self.por_md5.get(antigo.get("md5Checksum")) is antigo:
+                del self.por_md5[antigo["md5Checksum"]]
+            self.por_id[f["id"]] = f
+            self.por_nome[f["name"]] = f
+            self.por_md5[f["md5Checksum"]] = f
+            if dono:
+                self.donos[f["id"]] = dono
+
+    def _lock_nome(self, nome: str) -> threading.Lock:
+        with self._lock:
+            return self._locks_nome.setdefault(nome, threading.Lock())
+
+    def enviar(self, drive_service, caminho_pdf: str, nome_arquivo: str,
+               file_id: str = "", dono: str = "") -> Tuple[str, str]:
+        """
+        Garante o PDF no Drive com o menor número de chamadas. file_id: arquivo
+        já associado à linha (estado das propostas). Retorna (file_id, webViewLink).
+        """
+        if self.carregado_em is not None and time.monotonic() - self.carregado_em > INDICE_DRIVE_VALIDADE_SEG:
+            try:
+                self.carregar(drive_service)
+            except ExecucaoEncerrada:
+                raise
+            except Exception as e:
+                log_warn(f"[{self.alvo.rotulo}] Não consegui relistar a pasta do Drive: {e}")
+
+        md5 = md5_arquivo(caminho_pdf)
+
+        with self._lock_nome(nome_arquivo):
+            with self._lock:
+                existente = self.por_id.get(file_id) or ({"id": file_id} if file_id else None)
+                if existente is None:
+                    por_nome = self.por_nome.get(nome_arquivo)
+                    if por_nome and self.donos.get(por_nome["id"], dono) == dono:
+                        existente = por_nome
+                igual = self.por_md5.get(md5)
+
+            if existente and existente.get("md5Checksum") == md5 and existente.get("webViewLink"):
+                log_info(f"PDF idêntico já está no Drive: {nome_arquivo} ({existente['id']})")
+                return existente["id"], existente["webViewLink"]
+            if existente is None and igual and igual.get("webViewLink"):
+                log_info(f"PDF idêntico já está no Drive: {igual.get('name')} ({igual['id']})")
+                return igual["id"], igual["webViewLink"]
+
+            if existente:
+                try:
+                    link = atualizar_pdf_no_drive(drive_service, existente["id"], caminho_pdf, nome_arquivo)
+                    self._registrar({"id": existente["id"], "name": nome_arquivo,
+                                     "md5Checksum": md5, "webViewLink": link}, dono)
+                    return existente["id"], link
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        raise
+                    log_warn(f"PDF {existente['id']} não existe mais no Drive; criando outro.")
+                    with self._lock:
+                        self.por_id.pop(existente["id"], None)
+
+            novo_id, link = upload_pdf_para_drive(drive_service, self.alvo, caminho_pdf, nome_arquivo)
+            self._registrar({"id": novo_id, "name": nome_arquivo, "md5Checksum": md5, "webViewLink": link}, dono)
+            return novo_id, link
+
+# ==========================================================
+# ESTADO DAS PROPOSTAS (MODO RECALCULAR)
+# ==========================================================
+# Um registro por contrato com o hash da última proposta enviada e o
+# file_id do PDF no Drive. Arquivo JSONL só de acréscimo: cada envio
+# acrescenta uma linha e, na leitura, a última linha de cada chave vale.
+
+_ESTADO_PROPOSTAS_LOCK = threading.Lock()
+
+def chave_estado_proposta(alvo: AlvoPlanilha, contrato: str, forma: str) -> str:
+    return f"{alvo.spreadsheet_id}|{alvo.sheet_name}|{(contrato or '').strip()}|{forma}"
+
+def hash_proposta(proposta: PropostaAcordo) -> str:
+    """Hash estável do conteúdo da proposta (tudo que vai para o PDF e colunas O-R)."""
+    conteudo = json.dumps(asdict(proposta), default=str, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+def carregar_estado_propostas() -> Dict[str, Dict[str, str]]:
+    estado: Dict[str, Dict[str, str]] = {}
+    if not os.path.exists(ESTADO_PROPOSTAS_FILE):
+        return estado
+
+    linhas = 0
+    with open(ESTADO_PROPOSTAS_FILE, "r", encoding="utf-8") as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                reg = json.loads(linha)
+                estado[reg["chave"]] = reg
+                linhas += 1
+            except Exception:
+                # linha truncada (ex: PC desligado no meio da escrita)
+                continue
+
+    # compacta quando o histórico ficou bem maior que o estado atual
+    if linhas > 2 * len(estado) + 100:
+        tmp = ESTADO_PROPOSTAS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for reg in estado.values():
+                f.write(json.dumps(reg, ensure_ascii=False) + "\n")
+        os.replace(tmp, ESTADO_PROPOSTAS_FILE)
+
+    return estado
+
+def registrar_estado_proposta(estado: Dict[str, Dict[str, str]], alvo: AlvoPlanilha, contrato: str,
+                              forma: str, hash_atual: str, file_id: str, link: str, nome_pdf: str):
+    reg = {
+        "chave": chave_estado_proposta(alvo, contrato, forma),
+        "hash": hash_atual,
+        "file_id": file_id,
+        "link": link,
+        "nome": nome_pdf,
+        "atualizado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+    if alvo.simulado:
+        estado[reg["chave"]] = reg
+        return
+    try:
+        with _ESTADO_PROPOSTAS_LOCK:
+            estado[reg["chave"]] = reg
+            with open(ESTADO_PROPOSTAS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(reg, ensure_ascii=False) + "\n")
+    except Exception as e:
+        log_warn(f"Não consegui gravar estado da proposta ({contrato}): {e}")
+
 # ==========================================================
 # FIX: COLUNA P COMO TEXTO (BLINDA O SHEETS)
 # ==========================================================
 
-def garantir_coluna_p_como_texto(sheets_service):
+def garantir_coluna_p_como_texto(sheets_service, alvo: AlvoPlanilha):
     """
     Força a coluna P (VENCIMENTOS) a ser TEXT no Google Sheets,
-    evitando conversões automáticas.
+    evitando conversões automáticas. Vale também para a coluna de
+    vencimentos das demais formas de negociação configuradas.
     """
-    meta = sheets_service.spreadsheets().get(
-        spreadsheetId=SPREADSHEET_ID,
+    LIMITE_SHEETS_LEITURA.aguardar()
+    meta = executar_google(sheets_service.spreadsheets().get(
+        spreadsheetId=alvo.spreadsheet_id,
         fields="sheets(properties(sheetId,title))"
-    ).execute()
+    ))
 
     sheet_id = None
     for s in meta.get("sheets", []):
         props = s.get("properties", {})
-        if props.get("title") == SHEET_NAME:
+        if props.get("title") == alvo.sheet_name:
             sheet_id = props.get("sheetId")
             break
 
     if sheet_id is None:
-        raise ValueError(f"Aba não encontrada: {SHEET_NAME}")
-
-    requests_body = [{
-        "repeatCell": {
-            "range": {
-                "sheetId": sheet_id,
-                "startRowIndex": 1,        # a partir da linha 2 (0-based)
-                "startColumnIndex": 15,    # P
-                "endColumnIndex": 16       # até P
-            },
-            "cell": {
-                "userEnteredFormat": {
-                    "numberFormat": {"type": "TEXT"}
-                }
-            },
-            "fields": "userEnteredFormat.numberFormat"
-        }
-    }]
-
-    sheets_service.spreadsheets().batchUpdate(
-        spreadsheetId=SPREADSHEET_ID,
+        raise ValueError(f"Aba não encontrada: {alvo.sheet_name}")
+
+    requests_body = []
+    for forma in alvo.formas:
+        col = coluna_para_indice(forma.coluna_vencimentos)
+        requests_body.append({
+            "repeatCell": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "startRowIndex": 1,        # a partir da linha 2 (0-based)
+                    "startColumnIndex": col,   # P
+                    "endColumnIndex": col + 1  # até P
+                },
+                "cell": {
+                    "userEnteredFormat": {
+                        "numberFormat": {"type": "TEXT"}
+                    }
+                },
+                "fields": "userEnteredFormat.numberFormat"
+            }
+        })
+
+    LIMITE_SHEETS_ESCRITA.aguardar()
+    executar_google(sheets_service.spreadsheets().batchUpdate(
+        spreadsheetId=alvo.spreadsheet_id,
         body={"requests": requests_body}
-    ).execute()
+    ))
 
 # ==========================================================
 # SOAP
@@ -573,47 +1423,516 @@ def montar_envelope_soap(token: str, data_calculo: str, cod_cliente: str) -> str
 </soapenv:Envelope>
 """
 
-def chamar_ws(token: str, data_calculo: str, cod_cliente: str) -> str:
-    envelope = montar_envelope_soap(token, data_calculo, cod_cliente)
-    headers = {"Content-Type": "text/xml; charset=utf-8", "SOAPAction": SOAP_ACTION}
+NS_SOAP = {"soapenv": "http://schemas.xmlsoap.org/soap/envelope/", "sis": "siscobra"}
 
-    resp = requests.post(
-        BASE_URL,
-        data=envelope.encode("utf-8"),
-        headers=headers,
-        timeout=60,
-    )
-    resp.raise_for_status()
+_RE_DECLARACAO_XML = re.compile(r"^\s*<\?xml[^>]*\?>")
+_RE_ENTIDADE = re.compile(r"&(#[0-9]+;|#x[0-9A-Fa-f]+;|[A-Za-z][A-Za-z0-9]*;)?")
+_ENTIDADES_XML = {"amp;", "lt;", "gt;", "quot;", "apos;"}
 
-    root = etree.fromstring(resp.content)
-    ns = {"soapenv": "http://schemas.xmlsoap.org/soap/envelope/", "sis": "siscobra"}
+def _sanear_entidades(texto: str) -> Tuple[str, int]:
+    """
+    Corrige '&' que quebram o XML interno:
+    - '&' solto (ex: 'R&D') vira '&amp;'
+    - entidade HTML que o XML não conhece (ex: '&ccedil;') vira o próprio caractere
+    Retorna (texto corrigido, quantidade de correções).
+    """
+    correcoes = 0
+
+    def trocar(m: re.Match) -> str:
+        nonlocal correcoes
+        ent = m.group(1)
+        if ent is None:
+            correcoes += 1
+            return "&amp;"
+        if ent[0] == "#" or ent in _ENTIDADES_XML:
+            return m.group(0)
+        correcoes += 1
+        ch = html.unescape(m.group(0))
+        if ch == m.group(0):
+            return "&amp;" + ent
+        return html.escape(ch, quote=False)
+
+    return _RE_ENTIDADE.sub(trocar, texto), correcoes
+
+def decodificar_resposta_soap(conteudo: bytes, cod_cliente: str = "") -> etree._Element:
+    """
+    Lê o envelope SOAP (bytes da resposta) e devolve a raiz do XML interno (Xmlout)
+    já parseada, sem o vai-e-volta unescape -> str -> encode.
+    Se o XML interno vier com '&' sem escape, corrige e registra no log em vez de falhar.
+    """
+    root = etree.fromstring(conteudo)
 
-    xmlout_node = root.find(".//sis:WSAssessoria.ExecuteResponse/sis:Xmlout", namespaces=ns)
+    xmlout_node = root.find(".//sis:WSAssessoria.ExecuteResponse/sis:Xmlout", namespaces=NS_SOAP)
     if xmlout_node is None or xmlout_node.text is None:
         raise ValueError("Xmlout não encontrado na resposta SOAP")
 
-    return html.unescape(xmlout_node.text)
+    texto = xmlout_node.text
+    # o parser do envelope já desfez um nível de escape; se ainda vier "&lt;...", veio com escape duplo
+    if texto.lstrip().startswith("&lt;"):
+        texto = html.unescape(texto)
+    # str com declaração de encoding não é aceita pelo lxml; o texto já está decodificado
+    texto = _RE_DECLARACAO_XML.sub("", texto, count=1)
+
+    try:
+        return etree.fromstring(texto)
+    except etree.XMLSyntaxError as e:
+        erro_original = e
+
+    # só o '&' sem escape é corrigido; XML truncado ou malformado sobe o erro
+    # original para chamar_ws_com_retry tentar de novo (nunca parse tolerante:
+    # parcelas faltando dariam total errado no PDF e nas colunas O-R)
+    saneado, correcoes = _sanear_entidades(texto)
+    if correcoes:
+        try:
+            inner = etree.fromstring(saneado)
+        except etree.XMLSyntaxError:
+            raise erro_original
+        log_warn(f"Contrato {cod_cliente}: Xmlout com {correcoes} '&' inválido(s); corrigido automaticamente.")
+        return inner
+
+    raise erro_original
+
+def criar_sessao_soap() -> requests.Session:
+    """Sessão HTTP única (keep-alive) compartilhada por todos os alvos."""
+    sessao = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SOAP_MAX_SIMULTANEAS)
+    sessao.mount("https://", adapter)
+    sessao.mount("http://", adapter)
+    return sessao
+
+SESSAO_SOAP = criar_sessao_soap()
+
+def aquecer_conexoes_soap(quantas: int = SOAP_MAX_SIMULTANEAS):
+    """
+    Abre (TCP + TLS) até `quantas` conexões da SESSAO_SOAP com um HEAD em
+    BASE_URL, em threads daemon, sem esperar: a primeira chamada SOAP já
+    encontra conexão pronta no pool. Só usa vaga livre do SEMAFORO_SOAP.
+    """
+    if REPLAY_SOAP is not None:
+        return
+
+    def aquecer():
+        if not SEMAFORO_SOAP.acquire(blocking=False):
+            return
+        try:
+            SESSAO_SOAP.head(BASE_URL, timeout=10, allow_redirects=False)
+        except Exception as e:
+            log_warn(f"Não consegui pré-abrir conexão com o Siscobra: {e}")
+        finally:
+            SEMAFORO_SOAP.release()
+
+    for _ in range(quantas):
+        em_thread_daemon(aquecer)
+
+# ==========================================================
+# HEDGE SOAP
+# ==========================================================
+# Opcional (SISCOBRA_HEDGE_SOAP=1). Quando uma chamada passa do p95 das
+# latências observadas, uma cópia é enviada e vale a primeira resposta válida.
+# Limites para não sobrecarregar o Siscobra: no máximo SISCOBRA_HEDGE_MAX_PCT%
+# (padrão 10) das chamadas ganham cópia, e no máximo metade de
+# SOAP_MAX_SIMULTANEAS cópias ficam em voo ao mesmo tempo.
+# A chamada que perde não é cancelada (requests não permite); termina em
+# segundo plano ocupando a vaga e a resposta é descartada.
+
+def postar_soap(vaga: threading.BoundedSemaphore, transporte, dados: bytes, headers: Dict[str, str]):
+    """POST SOAP que devolve a vaga (já adquirida por quem chamou) ao terminar."""
+    try:
+        resp = transporte.post(BASE_URL, data=dados, headers=headers, timeout=60)
+        resp.raise_for_status()
+        return resp
+    finally:
+        vaga.release()
+
+class HedgeSoap:
+    AMOSTRAS = 200
+    MIN_AMOSTRAS = 20
+
+    def __init__(self):
+        self.ativo = False
+        self.max_fracao = 0.10
+        self.piso_seg = 1.0
+        self._latencias: "deque[float]" = deque(maxlen=self.AMOSTRAS)
+        self._lock = threading.Lock()
+        self._vagas_copia = threading.BoundedSemaphore(max(1, SOAP_MAX_SIMULTANEAS // 2))
+        self.zerar()
+
+    def iniciar_execucao(self):
+        """Lê a configuração do ambiente e zera os contadores da execução."""
+        self.ativo = env_ativo("SISCOBRA_HEDGE_SOAP")
+        self.max_fracao = env_int("SISCOBRA_HEDGE_MAX_PCT", 10) / 100
+        self.zerar()
+        if self.ativo:
+            log_info(f"Hedge SOAP ligado (até {self.max_fracao:.0%} das chamadas).")
+
+    def zerar(self):
+        with self._lock:
+            self.chamadas = 0
+            self.copias = 0
+            self.vitorias_copia = 0
+            self.economia_s = 0.0
+
+    def limite_seg(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencias) < self.MIN_AMOSTRAS:
+                return None
+            p95 = statistics.quantiles(self._latencias, n=20)[-1]
+        return max(self.piso_seg, p95)
+
+    def _reservar_copia(self) -> bool:
+        with self._lock:
+            if self.copias + 1 > self.max_fracao * self.chamadas:
+                return False
+            if not self._vagas_copia.acquire(blocking=False):
+                return False
+            self.copias += 1
+            return True
+
+    def _ao_terminar_primaria(self, futuro, inicio: float):
+        if futuro.exception() is None:
+            with self._lock:
+                self._latencias.append(time.monotonic() - inicio)
+
+    def _somar_economia(self, segundos: float):
+        with self._lock:
+            self.economia_s += max(0.0, segundos)
+
+    def postar(self, transporte, dados: bytes, headers: Dict[str, str]):
+        """Envia a chamada (com cópia, se ela demorar). Retorna (resposta, latência)."""
+        with self._lock:
+            self.chamadas += 1
+
+        adquirir_vaga_soap()
+        inicio = time.monotonic()
+        primaria = em_thread_daemon(postar_soap, SEMAFORO_SOAP, transporte, dados, headers)
+        primaria.add_done_callback(lambda f: self._ao_terminar_primaria(f, inicio))
+
+        limite = self.limite_seg()
+        if limite is None:
+            return aguardar_futuro(primaria), time.monotonic() - inicio
+        try:
+            return aguardar_futuro(primaria, limite), time.monotonic() - inicio
+        except FuturesTimeout:
+            if primaria.done():
+                raise
+
+        if not self._reservar_copia():
+            return aguardar_futuro(primaria), time.monotonic() - inicio
+
+        copia = em_thread_daemon(postar_soap, self._vagas_copia, transporte, dados, headers)
+        pendentes = {primaria, copia}
+        erro: Optional[BaseException] = None
+        while pendentes:
+            feitos, pendentes = wait(pendentes, timeout=ESPERA_ENCERRAR_SEG, return_when=FIRST_COMPLETED)
+            if not feitos and STOP_EVENT.is_set():
+                raise ExecucaoEncerrada()
+            for futuro in feitos:
+                if futuro.exception() is not None:
+                    erro = futuro.exception()
+                    continue
+                decorrido = time.monotonic() - inicio
+                if futuro is copia:
+                    with self._lock:
+                        self.vitorias_copia += 1
+                    primaria.add_done_callback(
+                        lambda f: self._somar_economia(time.monotonic() - inicio - decorrido))
+                return futuro.result(), decorrido
+        raise erro
+
+    def resumo(self) -> str:
+        with self._lock:
+            taxa = self.copias / self.chamadas if self.chamadas else 0.0
+            return (f"Hedge SOAP: {self.copias} cópia(s) em {self.chamadas} chamadas ({taxa:.1%}), "
+                    f"{self.vitorias_copia} vencida(s) pela cópia, ~{self.economia_s:.1f}s de latência economizados.")
+
+HEDGE_SOAP = HedgeSoap()
+
+def chamar_ws(token: str, data_calculo: str, cod_cliente: str,
+              medicao: Optional[Dict[str, float]] = None) -> etree._Element:
+    """medicao (opcional): recebe "soap_s" (latência da chamada) e "bytes" (tamanho da resposta)."""
+    envelope = montar_envelope_soap(token, data_calculo, cod_cliente)
+    headers = {"Content-Type": "text/xml; charset=utf-8", "SOAPAction": SOAP_ACTION}
+
+    dados = envelope.encode("utf-8")
+    transporte = REPLAY_SOAP or SESSAO_SOAP
+    with trecho("soap.post", bytes_envio=len(dados), hedge=HEDGE_SOAP.ativo) as rastro:
+        if HEDGE_SOAP.ativo:
+            resp, latencia = HEDGE_SOAP.postar(transporte, dados, headers)
+        else:
+            with trecho("soap.fila"):
+                adquirir_vaga_soap()
+            inicio = time.monotonic()
+            resp = executar_interrompivel(postar_soap, SEMAFORO_SOAP, transporte, dados, headers)
+            latencia = time.monotonic() - inicio
+        if rastro is not None:
+            rastro["bytes_resposta"] = len(resp.content)
+
+    if GRAVADOR_SOAP is not None:
+        GRAVADOR_SOAP.gravar(cod_cliente, data_calculo, envelope, resp.content, latencia)
+
+    inicio_parse = time.monotonic()
+    with trecho("parse.soap", bytes=len(resp.content)):
+        inner = decodificar_resposta_soap(resp.content, cod_cliente)
+
+    if medicao is not None:
+        medicao["soap_s"] = latencia
+        medicao["bytes"] = len(resp.content)
+        medicao["parse_s"] = time.monotonic() - inicio_parse
+
+    return inner
 
 def chamar_ws_com_retry(token: str, data_calculo: str, cod_cliente: str,
-                        tentativas: int = 4, espera_seg: int = 5) -> str:
+                        tentativas: int = 4, espera_seg: int = 5,
+                        medicao: Optional[Dict[str, float]] = None) -> etree._Element:
     ultima_excecao = None
     for tentativa in range(1, tentativas + 1):
         try:
             log_info(f"SOAP contrato {cod_cliente} - tentativa {tentativa}/{tentativas}")
-            return chamar_ws(token, data_calculo, cod_cliente)
+            with trecho("soap.tentativa", contrato=cod_cliente, tentativa=tentativa):
+                return chamar_ws(token, data_calculo, cod_cliente, medicao=medicao)
+        except ExecucaoEncerrada:
+            raise
         except Exception as e:
             ultima_excecao = e
             log_error(f"Falha SOAP contrato {cod_cliente} (tentativa {tentativa}): {e}")
             if tentativa < tentativas:
-                time.sleep(espera_seg)
+                with trecho("soap.espera_retry", segundos=espera_seg):
+                    dormir(espera_seg)
     raise RuntimeError(f"Falha SOAP após {tentativas} tentativas") from ultima_excecao
 
+# ==========================================================
+# CAPTURA / REPLAY SOAP
+# ==========================================================
+# Com SISCOBRA_GRAVAR_SOAP=1, cada chamada SOAP de uma execução real é gravada
+# em APP_DIR/capturas/soap-<data>.sqlite (envelope e resposta compactados com
+# zlib, indexados por contrato). "python main.py --replay <arquivo>" roda o
+# mesmo pipeline (parse, PDF, upload) com essas respostas no lugar da rede e
+# com Google falso, para medir parse/PDF com dados reais sem tocar no Siscobra.
+
+GRAVADOR_SOAP: Optional["GravadorSoap"] = None
+REPLAY_SOAP: Optional["ReplaySoap"] = None
+
+class GravadorSoap:
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(caminho, check_same_thread=False)
+        self._con.execute(
+            """CREATE TABLE IF NOT EXISTS chamadas (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   cod_cliente TEXT NOT NULL,
+                   data_calculo TEXT NOT NULL,
+                   gravado_em TEXT NOT NULL,
+                   latencia_s REAL NOT NULL,
+                   bytes INTEGER NOT NULL,
+                   requisicao BLOB NOT NULL,
+                   resposta BLOB NOT NULL
+               )"""
+        )
+        self._con.execute("CREATE INDEX IF NOT EXISTS idx_chamadas_cod ON chamadas (cod_cliente, data_calculo)")
+        self._con.commit()
+
+    def gravar(self, cod_cliente: str, data_calculo: str, envelope: str, resposta: bytes, latencia: float):
+        try:
+            with self._lock:
+                self._con.execute(
+                    "INSERT INTO chamadas (cod_cliente, data_calculo, gravado_em, latencia_s, bytes, requisicao, resposta)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        cod_cliente, data_calculo, datetime.now().isoformat(timespec="seconds"),
+                        latencia, len(resposta),
+                        zlib.compress(envelope.encode("utf-8")), zlib.compress(resposta),
+                    ),
+                )
+                self._con.commit()
+        except Exception as e:
+            log_warn(f"Falha ao gravar captura SOAP ({cod_cliente}): {e}")
+
+    def fechar(self):
+        with self._lock:
+            self._con.close()
+
+def iniciar_gravacao_soap() -> Optional[GravadorSoap]:
+    global GRAVADOR_SOAP
+    if not env_ativo("SISCOBRA_GRAVAR_SOAP"):
+        return None
+    os.makedirs(CAPTURAS_DIR, exist_ok=True)
+    caminho = os.path.join(CAPTURAS_DIR, f"soap-{RUN_ID}.sqlite")
+    GRAVADOR_SOAP = GravadorSoap(caminho)
+    log_info(f"Gravando chamadas SOAP em: {caminho}")
+    return GRAVADOR_SOAP
+
+def encerrar_gravacao_soap():
+    global GRAVADOR_SOAP
+    if GRAVADOR_SOAP is not None:
+        GRAVADOR_SOAP.fechar()
+        GRAVADOR_SOAP = None
+
+class _RespostaGravada:
+    status_code = 200
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+class ReplaySoap:
+    """Responde às chamadas do chamar_ws com as respostas gravadas (última gravação de cada contrato)."""
+    _RE_COD = re.compile(r"&lt;COD_CLIENTE&gt;(.*?)&lt;/COD_CLIENTE&gt;")
+
+    def __init__(self, caminho: str):
+        if not os.path.exists(caminho):
+            raise FileNotFoundError(f"Captura SOAP não encontrada: {caminho}")
+        self.caminho = caminho
+        con = sqlite3.connect(caminho)
+        try:
+            linhas = con.execute(
+                "SELECT cod_cliente, data_calculo, resposta FROM chamadas ORDER BY id"
+            ).fetchall()
+        finally:
+            con.close()
+        # já descompacta tudo: no replay o tempo medido deve ser só parse/PDF
+        self.respostas: Dict[str, bytes] = {}
+        self.datas: Dict[str, str] = {}
+        for cod, data_calculo, resposta in linhas:
+            self.respostas[cod] = zlib.decompress(resposta)
+            self.datas[cod] = data_calculo
+
+    def post(self, url: str, data: bytes = b"", headers=None, timeout=None) -> _RespostaGravada:
+        m = self._RE_COD.search(data.decode("utf-8"))
+        cod = m.group(1) if m else ""
+        if cod not in self.respostas:
+            raise ValueError(f"Contrato {cod} não está na captura {os.path.basename(self.caminho)}")
+        return _RespostaGravada(self.respostas[cod])
+
+class _ChamadaFalsa:
+    def __init__(self, resultado: dict):
+        self._resultado = resultado
+
+    def execute(self, *args, **kwargs) -> dict:
+        return self._resultado
+
+class GoogleFalso:
+    """Sheets e Drive de mentira para o replay: aceita as chamadas do robô e não envia nada."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.bytes_enviados = 0
+
+    def spreadsheets(self): return self
+    def values(self): return self
+    def files(self): return self
+    def permissions(self): return self
+
+    def get(self, **kwargs): return _ChamadaFalsa({})
+    def batchUpdate(self, **kwargs): return _ChamadaFalsa({})
+    def list(self, **kwargs): return _ChamadaFalsa({"files": []})
+
+    def _enviar(self, media_body) -> None:
+        if media_body is not None:
+            # lê o arquivo como um upload leria
+            self.bytes_enviados += len(media_body.getbytes(0, media_body.size()))
+
+    def create(self, body=None, media_body=None, fileId=None, **kwargs):
+        self._enviar(media_body)
+        file_id = fileId or f"replay-{next(self._ids)}"
+        return _ChamadaFalsa({"id": file_id, "webViewLink": f"https://drive.invalid/{file_id}"})
+
+    def update(self, fileId=None, media_body=None, **kwargs):
+        self._enviar(media_body)
+        return _ChamadaFalsa({"id": fileId, "webViewLink": f"https://drive.invalid/{fileId}"})
+
+def executar_replay(caminho: str, workers: int = 1, formas: Optional[List[str]] = None):
+    """
+    Roda parse + PDF + upload (falso) para cada contrato da captura, o mais
+    rápido possível, e registra no log o tempo por etapa.
+    """
+    global REPLAY_SOAP
+    replay = ReplaySoap(caminho)
+    contratos = list(replay.respostas)
+    if not contratos:
+        log_warn("Captura SOAP vazia.")
+        return
+
+    try:
+        formas_alvo = carregar_formas_negociacao({"formas_negociacao": formas} if formas else carregar_ids_google()["alvos"][0])
+    except FileNotFoundError:
+        formas_alvo = carregar_formas_negociacao({})
+
+    alvo = AlvoPlanilha(indice=0, spreadsheet_id="replay", sheet_name="replay", drive_folder_id="replay",
+                        formas=formas_alvo, nome="replay", linhas_simultaneas=workers, simulado=True)
+    linhas = [LinhaPendente(numero=i, valores=[], contrato=c, cpf_planilha="", formas=list(formas_alvo))
+              for i, c in enumerate(contratos, start=2)]
+    # mesma data de cálculo da gravação (o atraso das parcelas depende dela)
+    data_calc = statistics.mode(replay.datas.values())
+
+    log_info(f"Replay de {len(linhas)} contratos de {caminho} ({workers} worker(s), data de cálculo {data_calc})")
+
+    google = GoogleFalso()
+    estado: Dict[str, Dict[str, str]] = {}
+    medicoes: List[Dict[str, float]] = []
+    medicoes_lock = threading.Lock()
+    fila: "queue.Queue[LinhaPendente]" = queue.Queue()
+    for linha in linhas:
+        fila.put(linha)
+
+    def worker():
+        while True:
+            try:
+                linha = fila.get_nowait()
+            except queue.Empty:
+                return
+            medicao: Dict[str, float] = {}
+            status = processar_linha(google, google, alvo, linha, data_calc, estado, medicao=medicao)
+            medicao["erro"] = 1.0 if status == "erro" else 0.0
+            with medicoes_lock:
+                medicoes.append(medicao)
+
+    limites = (LIMITE_SHEETS_LEITURA, LIMITE_SHEETS_ESCRITA, LIMITE_DRIVE)
+    REPLAY_SOAP = replay
+    for lim in limites:
+        lim.ativo = False
+    iniciar_rastreio(f"replay-{novo_run_id()}")
+    METRICAS_PDF.zerar()
+    inicio = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for futuro in [pool.submit(worker) for _ in range(max(1, workers))]:
+                futuro.result()
+    finally:
+        encerrar_rastreio()
+        REPLAY_SOAP = None
+        for lim in limites:
+            lim.ativo = True
+    total = time.monotonic() - inicio
+
+    def soma(k: str) -> float:
+        return sum(m.get(k, 0.0) for m in medicoes)
+
+    log_info(
+        f"Replay concluído: {len(medicoes)} contratos em {total:.2f}s "
+        f"({len(medicoes) / total if total else 0:.1f}/s), erros {int(soma('erro'))}. "
+        f"Parse {soma('parse_s'):.2f}s | PDF {soma('pdf_s'):.2f}s | "
+        f"parcelas {int(soma('parcelas'))} | bytes SOAP {int(soma('bytes'))} | PDFs {google.bytes_enviados} bytes"
+    )
+    log_info(METRICAS_PDF.resumo())
+
 # ==========================================================
 # PARSE XML
 # ==========================================================
 
-def extrair_proposta(xml_inner: str, nome_forma: str, data_calculo: str) -> PropostaAcordo:
-    root = etree.fromstring(xml_inner.encode("utf-8"))
+def extrair_propostas(xml_inner: str | etree._Element, nomes_formas: List[str],
+                      data_calculo: str) -> Dict[str, PropostaAcordo]:
+    """
+    Monta, num único passe pelo XML, uma PropostaAcordo para cada forma de
+    negociação pedida (a resposta do OBTER_DIVIDA_CALCULADA já traz todas).
+    xml_inner: raiz já parseada (de chamar_ws) ou o XML interno como texto.
+    """
+    if isinstance(xml_inner, etree._Element):
+        root = xml_inner
+    else:
+        root = etree.fromstring(xml_inner.encode("utf-8"))
     primeira_parcela = root.find(".//parcelas/parcela")
 
     condominio = ""
@@ -634,21 +1953,24 @@ def extrair_proposta(xml_inner: str, nome_forma: str, data_calculo: str) -> Prop
         cep = (primeira_parcela.findtext("cli_cep") or "").strip()
         telefone = (primeira_parcela.findtext("cli_tel") or "").strip()
 
-    proposta = PropostaAcordo(
-        condominio=condominio,
-        adm=adm,
-        cliente=cliente,
-        cpf_cnpj=cpf_cnpj,
-        endereco=endereco,
-        bairro=bairro,
-        cep=cep,
-        telefone=telefone,
-        data_calculo=data_calculo,
-    )
+    propostas: Dict[str, PropostaAcordo] = {}
+    for nome in nomes_formas:
+        propostas[nome] = PropostaAcordo(
+            condominio=condominio,
+            adm=adm,
+            cliente=cliente,
+            cpf_cnpj=cpf_cnpj,
+            endereco=endereco,
+            bairro=bairro,
+            cep=cep,
+            telefone=telefone,
+            data_calculo=data_calculo,
+        )
 
     for forma in root.findall(".//forma_negociacao"):
         for_nom = (forma.findtext("for_nom") or "").strip()
-        if for_nom != nome_forma:
+        proposta = propostas.get(for_nom)
+        if proposta is None:
             continue
 
         for parcela in forma.findall(".//parcelas/parcela"):
@@ -692,17 +2014,18 @@ def extrair_proposta(xml_inner: str, nome_forma: str, data_calculo: str) -> Prop
                 )
             )
 
-    return proposta
+    return propostas
 
 # ==========================================================
 # PDF
 # ==========================================================
 
-def montar_nome_pdf(proposta: PropostaAcordo, contrato: str) -> str:
+def montar_nome_pdf(proposta: PropostaAcordo, contrato: str, forma: str = "") -> str:
     """
     Exigência:
     - base: "PLANILHA - <Condomínio>"
     - se contrato tiver sufixo após '-', acrescenta: "-<sufixo>"
+    - formas de negociação além da principal acrescentam " (<forma>)"
     """
     cond = (proposta.condominio or "").strip()
     base = f"PLANILHA - {cond}".strip(" -")
@@ -714,22 +2037,92 @@ def montar_nome_pdf(proposta: PropostaAcordo, contrato: str) -> str:
     if suf:
         base = f"{base}-{suf}"
 
+    if forma:
+        base = f"{base} ({forma})"
+
     return sanitize_filename(base) + ".pdf"
 
-def gerar_pdf_proposta(proposta: PropostaAcordo, caminho_pdf: str) -> Decimal:
+# Devedor com muitas parcelas: acima de PDF_LINHAS_TABELA_UNICA linhas, a tabela
+# vira uma Table por página (cabeçalho repetido em todas), com larguras de coluna
+# e altura de linha fixas calculadas uma vez. A Table única é copiada e remedida
+# a cada quebra de página, o que deixa o tempo quadrático no número de parcelas.
+PDF_LINHAS_TABELA_UNICA = 200
+PDF_FONTE_TABELA = 8.8
+PDF_ALTURA_LINHA = 18       # leading 12 + padding 3 + 3: a mesma da Table automática
+PDF_PADDING_COLUNA = 12     # LEFTPADDING + RIGHTPADDING padrão (6 + 6)
+
+# Perfil compacto (padrão; SISCOBRA_PDF_COMPACTO=0 volta ao perfil antigo):
+# streams só com Flate (o ASCII85 do reportlab aumenta o conteúdo comprimido
+# em 25%), metadados vazios e estilos criados uma vez para o processo todo. As
+# fontes continuam as Type1 padrão (Helvetica), que não são embutidas. O texto
+# e o desenho das páginas não mudam: python main.py --verificar-pdf compara.
+PDF_COMPACTO = env_int("SISCOBRA_PDF_COMPACTO", 1) != 0
+PDF_METADADOS_VAZIOS = {"title": "", "author": "", "subject": "", "creator": "", "producer": ""}
+
+def aplicar_perfil_pdf(compacto: bool):
+    """useA85 é global no reportlab: vale para todos os PDFs do processo."""
+    global PDF_COMPACTO
+    PDF_COMPACTO = compacto
+    rl_config.useA85 = 0 if compacto else 1
+
+aplicar_perfil_pdf(PDF_COMPACTO)
+
+_ESTILOS_BASE = getSampleStyleSheet()
+ESTILO_PDF_TITULO = ParagraphStyle("title", parent=_ESTILOS_BASE["Title"], fontSize=16, leading=18, spaceAfter=6)
+ESTILO_PDF_NORMAL = ParagraphStyle("normal", parent=_ESTILOS_BASE["Normal"], fontSize=9.5, leading=11)
+ESTILO_PDF_ROTULO = ParagraphStyle("label", parent=_ESTILOS_BASE["Normal"], fontSize=9.5, leading=11)
+
+class MetricasPdf:
+    """Bytes dos PDFs gerados e dos enviados ao Drive (PDF idêntico reaproveitado não conta)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.gerados = 0
+            self.bytes_gerados = 0
+            self.enviados = 0
+            self.bytes_enviados = 0
+
+    def gerado(self, caminho_pdf: str) -> int:
+        tamanho = os.path.getsize(caminho_pdf)
+        with self._lock:
+            self.gerados += 1
+            self.bytes_gerados += tamanho
+        return tamanho
+
+    def enviado(self, caminho_pdf: str):
+        tamanho = os.path.getsize(caminho_pdf)
+        with self._lock:
+            self.enviados += 1
+            self.bytes_enviados += tamanho
+
+    def resumo(self) -> str:
+        with self._lock:
+            media = self.bytes_gerados / self.gerados / 1024 if self.gerados else 0.0
+            return (f"PDFs ({'compacto' if PDF_COMPACTO else 'padrão'}): {self.gerados} gerado(s), "
+                    f"{media:.1f} KB por PDF; {self.enviados} enviado(s) ao Drive, "
+                    f"{self.bytes_enviados / 1024 / 1024:.2f} MB no total.")
+
+METRICAS_PDF = MetricasPdf()
+
+def gerar_pdf_proposta(proposta: PropostaAcordo, caminho_pdf: str,
+                       linhas_tabela_unica: int = PDF_LINHAS_TABELA_UNICA) -> Decimal:
+    # invariant: sem data de criação/ID aleatório, o mesmo conteúdo gera o
+    # mesmo arquivo (e o mesmo md5 no índice do Drive)
     doc = SimpleDocTemplate(
         caminho_pdf,
+        invariant=1,
         pagesize=A4,
         leftMargin=28,
         rightMargin=28,
         topMargin=28,
         bottomMargin=28,
+        **(PDF_METADADOS_VAZIOS if PDF_COMPACTO else {}),
     )
-    styles = getSampleStyleSheet()
-
-    title = ParagraphStyle("title", parent=styles["Title"], fontSize=16, leading=18, spaceAfter=6)
-    normal = ParagraphStyle("normal", parent=styles["Normal"], fontSize=9.5, leading=11)
-    label = ParagraphStyle("label", parent=styles["Normal"], fontSize=9.5, leading=11)
+    title, normal, label = ESTILO_PDF_TITULO, ESTILO_PDF_NORMAL, ESTILO_PDF_ROTULO
 
     elements = []
 
@@ -805,22 +2198,248 @@ def gerar_pdf_proposta(proposta: PropostaAcordo, caminho_pdf: str) -> Decimal:
         br_money(tot_total),
     ])
 
-    table = Table(data, repeatRows=1, hAlign="LEFT")
-    table.setStyle(TableStyle([
+    if len(data) - 1 > linhas_tabela_unica:
+        altura_pagina = doc.height - 12   # padding do Frame (6 em cima, 6 embaixo)
+        ocupado = sum(f.wrap(doc.width - 12, altura_pagina)[1] + f.getSpaceBefore() + f.getSpaceAfter()
+                      for f in elements)
+        elements.extend(tabelas_por_pagina(data, altura_pagina - ocupado, altura_pagina))
+    else:
+        table = Table(data, repeatRows=1, hAlign="LEFT")
+        table.setStyle(ESTILOS_TABELA_PDF[True])
+        elements.append(table)
+
+    doc.build(elements)
+    return tot_total
+
+def estilo_tabela_pdf(com_total: bool) -> TableStyle:
+    comandos = [
         ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
         ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
         ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, -1), 8.8),
+        ("FONTSIZE", (0, 0), (-1, -1), PDF_FONTE_TABELA),
         ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
         ("ALIGN", (0, 0), (2, -1), "LEFT"),
         ("ALIGN", (3, 1), (-1, -1), "RIGHT"),
-        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
-        ("BACKGROUND", (0, -1), (-1, -1), colors.whitesmoke),
-    ]))
+    ]
+    if com_total:
+        comandos += [
+            ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+            ("BACKGROUND", (0, -1), (-1, -1), colors.whitesmoke),
+        ]
+    return TableStyle(comandos)
 
-    elements.append(table)
-    doc.build(elements)
-    return tot_total
+ESTILOS_TABELA_PDF = {com_total: estilo_tabela_pdf(com_total) for com_total in (False, True)}
+
+def tabelas_por_pagina(data: List[List[str]], altura_primeira: float, altura_pagina: float) -> List[Any]:
+    """
+    data = cabeçalho + parcelas + total. Devolve uma Table por página (com o
+    cabeçalho) separadas por PageBreak, todas com as mesmas larguras de
+    coluna, calculadas uma vez como a Table automática faria.
+    """
+    cabecalho, corpo = data[0], data[1:]
+    larguras = []
+    for i in range(len(cabecalho)):
+        maior = max(stringWidth(cabecalho[i], "Helvetica-Bold", PDF_FONTE_TABELA),
+                    stringWidth(corpo[-1][i], "Helvetica-Bold", PDF_FONTE_TABELA),
+                    max((stringWidth(row[i], "Helvetica", PDF_FONTE_TABELA) for row in corpo[:-1]), default=0))
+        larguras.append(maior + PDF_PADDING_COLUNA)
+
+    linhas_pagina = max(1, int(altura_pagina // PDF_ALTURA_LINHA) - 1)
+    capacidade = max(1, int(altura_primeira // PDF_ALTURA_LINHA) - 2)   # folga: spaceBefore/After estimados
+    tabelas: List[Any] = []
+    inicio = 0
+    while inicio < len(corpo):
+        bloco = corpo[inicio:inicio + capacidade]
+        inicio += capacidade
+        ultimo = inicio >= len(corpo)
+        tabela = Table([cabecalho] + bloco, colWidths=larguras, rowHeights=PDF_ALTURA_LINHA,
+                       repeatRows=1, hAlign="LEFT")
+        tabela.setStyle(ESTILOS_TABELA_PDF[ultimo])
+        tabelas.append(tabela)
+        if not ultimo:
+            tabelas.append(PageBreak())
+        capacidade = linhas_pagina
+    return tabelas
+
+def proposta_sintetica(n: int) -> PropostaAcordo:
+    """Proposta com n parcelas fictícias, para medir e conferir o PDF."""
+    parcelas = [
+        ParcelaResumo(
+            contrato="12345-101", parcela_codigo=str(i),
+            vencimento=date.fromordinal(date(2020, 1, 10).toordinal() + 30 * i).strftime("%d/%m/%Y"),
+            atraso_dias=30 * (n - i), principal=Decimal("350.00"), correcao=Decimal("12.34"),
+            juros=Decimal("7.89"), multa=Decimal("7.00"), ho=Decimal("113.17"),
+            desconto=Decimal("0"), total=Decimal("490.40"),
+        )
+        for i in range(n)
+    ]
+    return PropostaAcordo(condominio="CONDOMÍNIO BENCHMARK", adm="ADM", cliente="JOSÉ DA CONCEIÇÃO",
+                          cpf_cnpj="12345678909", endereco="RUA DAS ARAUCÁRIAS, 100 - AP 12",
+                          bairro="ÁGUA VERDE", cep="80000-000", telefone="(41) 99999-0000",
+                          data_calculo="31/12/2025", parcelas=parcelas)
+
+def benchmark_pdf(tamanhos: Tuple[int, ...] = (10, 100, 1000, 5000)):
+    """
+    Tempo de gerar_pdf_proposta com N parcelas sintéticas, na tabela única e
+    na tabela por página (python main.py --benchmark-pdf).
+    """
+    os.makedirs(PDF_DIR, exist_ok=True)
+    caminho = os.path.join(PDF_DIR, "benchmark.pdf")
+    log_info("Parcelas | tabela única (s) | por página (s) | por página (ms/parcela) | tamanho (KB)")
+    for n in tamanhos:
+        proposta = proposta_sintetica(n)
+        inicio = time.perf_counter()
+        gerar_pdf_proposta(proposta, caminho, linhas_tabela_unica=n + 1)
+        unica = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        gerar_pdf_proposta(proposta, caminho, linhas_tabela_unica=0)
+        por_pagina = time.perf_counter() - inicio
+        log_info(f"{n:8d} | {unica:16.3f} | {por_pagina:14.3f} | {1000 * por_pagina / n:23.3f} | "
+                 f"{os.path.getsize(caminho) / 1024:12.1f}")
+    safe_delete_file(caminho)
+
+_RE_OBJETO_PDF = re.compile(rb"\d+ \d+ obj\s*")
+_RE_STREAM_PDF = re.compile(rb"\s*stream\r?\n")
+
+def _fim_dicionario_pdf(dados: bytes, pos: int) -> int:
+    """Posição logo depois do '>>' que fecha o '<<' em pos (dicionários aninhados contam)."""
+    nivel = 0
+    while pos < len(dados):
+        if dados.startswith(b"<<", pos):
+            nivel += 1
+            pos += 2
+        elif dados.startswith(b">>", pos):
+            nivel -= 1
+            pos += 2
+            if nivel == 0:
+                return pos
+        else:
+            pos += 1
+    raise ValueError("PDF com dicionário sem fechamento")
+
+def conteudo_paginas_pdf(caminho_pdf: str) -> List[bytes]:
+    """
+    Content streams do PDF já decodificados (ASCII85 e/ou Flate), na ordem do
+    arquivo. Percorre objeto a objeto ("N 0 obj << ... >> stream") e pula o
+    corpo de cada stream pelo /Length, para não confundir binário com sintaxe.
+    """
+    with open(caminho_pdf, "rb") as f:
+        dados = f.read()
+    streams = []
+    pos = 0
+    while True:
+        m = _RE_OBJETO_PDF.search(dados, pos)
+        if not m:
+            break
+        pos = m.end()
+        if not dados.startswith(b"<<", pos):
+            continue
+        fim = _fim_dicionario_pdf(dados, pos)
+        dicionario = dados[pos:fim]
+        pos = fim
+        ms = _RE_STREAM_PDF.match(dados, fim)
+        if not ms:
+            continue
+        tamanho = int(re.search(rb"/Length (\d+)", dicionario).group(1))
+        corpo = dados[ms.end():ms.end() + tamanho]
+        pos = ms.end() + tamanho
+        if b"/Subtype" in dicionario:   # imagens e formulários: não são conteúdo de página
+            continue
+        if b"/ASCII85Decode" in dicionario:
+            corpo = base64.a85decode(corpo.strip(), adobe=True)
+        if b"/FlateDecode" in dicionario:
+            corpo = zlib.decompress(corpo)
+        streams.append(corpo)
+    return streams
+
+_ESCAPES_PDF = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+def _desescapar_string_pdf(m: re.Match) -> bytes:
+    esc = m.group(1)
+    if esc[:1].isdigit():
+        return bytes([int(esc, 8) & 0xFF])
+    return _ESCAPES_PDF.get(esc, esc)
+
+def texto_pdf(caminho_pdf: str) -> List[str]:
+    """Strings desenhadas (operador Tj) em todas as páginas, na ordem (WinAnsi -> str)."""
+    textos = []
+    for corpo in conteudo_paginas_pdf(caminho_pdf):
+        for s in re.findall(rb"\(((?:\\.|[^\\)])*)\)\s*Tj", corpo, re.S):
+            s = re.sub(rb"\\([0-7]{1,3}|.)", _desescapar_string_pdf, s, flags=re.S)
+            textos.append(s.decode("cp1252"))
+    return textos
+
+# Texto de proposta_sintetica(n) como o gerador saía antes do perfil compacto
+# (data de impressão trocada por "{hoje}"). Com 1 parcela, a lista inteira;
+# nas maiores, (strings, páginas, sha256 das strings unidas por "\n").
+PDF_TEXTO_REFERENCIA_1 = [
+    "BERNARTT & BERNARTT", "Endereco: R. JOAO PALOMEQUE, NOVO MUNDO, CURITIBA, PR",
+    "CNPJ: 07.669.409/0001-44 Contato: (41) 99226-6332",
+    "Data Impressão:", " {hoje}", "Condomínio:", " CONDOMÍNIO BENCHMARK", "ADM:", " ADM",
+    "Cliente:", " JOSÉ DA CONCEIÇÃO", "CPF/CNPJ:", " 123.456.789-09",
+    "Endereço:", " RUA DAS ARAUCÁRIAS, 100 - AP 12", "Bairro:", " ÁGUA VERDE",
+    "Cep:", " 80000-000", "Fone:", " (41) 99999-0000", "Data Cálculo:", " 31/12/2025",
+    "Contrato", "Vencimento", "Atraso", "Principal", "Correção", "Juros", "Multa", "Honorários", "Total",
+    "12345-101", "10/01/2020", "30", "R$ 350,00", "R$ 12,34", "R$ 7,89", "R$ 7,00", "R$ 113,17", "R$ 490,40",
+    "Total", "R$ 350,00", "R$ 12,34", "R$ 7,89", "R$ 7,00", "R$ 113,17", "R$ 490,40",
+]
+PDF_TEXTO_REFERENCIA = {
+    10: (129, 1, "5b0ca1c087ea4fb51b2278593e1754a05c8f37aabbd766745e54ac2adf254e9f"),
+    300: (2802, 8, "7312433a8c1fedb27cd28f725a61f6b15de973496221459d15feabf15175db73"),
+}
+
+def _conferir_texto_referencia(n: int, caminho_pdf: str) -> Optional[str]:
+    """None se o texto do PDF bate com a referência de n parcelas; senão, a diferença."""
+    hoje = date.today().strftime("%d/%m/%y")
+    textos = [t.replace(hoje, "{hoje}") for t in texto_pdf(caminho_pdf)]
+    if n == 1:
+        if textos == PDF_TEXTO_REFERENCIA_1:
+            return None
+        for i, (atual, esperado) in enumerate(zip(textos, PDF_TEXTO_REFERENCIA_1)):
+            if atual != esperado:
+                return f"string {i}: {atual!r} em vez de {esperado!r}"
+        return f"{len(textos)} strings em vez de {len(PDF_TEXTO_REFERENCIA_1)}"
+    quantidade, paginas, digest = PDF_TEXTO_REFERENCIA[n]
+    atual = (len(textos), len(conteudo_paginas_pdf(caminho_pdf)),
+             hashlib.sha256("\n".join(textos).encode("utf-8")).hexdigest())
+    if atual == (quantidade, paginas, digest):
+        return None
+    return f"{atual[0]} strings/{atual[1]} páginas em vez de {quantidade}/{paginas} (ou conteúdo diferente)"
+
+def verificar_pdf_compacto(tamanhos: Tuple[int, ...] = (1, 10, 300)) -> bool:
+    """
+    Gera proposta_sintetica(n) nos perfis padrão e compacto e confere o texto
+    de cada um com o texto de referência do gerador anterior
+    (python main.py --verificar-pdf). Retorna True se tudo bate.
+    """
+    os.makedirs(PDF_DIR, exist_ok=True)
+    perfil_original = PDF_COMPACTO
+    caminhos = {c: os.path.join(PDF_DIR, f"verificar-{'compacto' if c else 'padrao'}.pdf") for c in (False, True)}
+    iguais = True
+    try:
+        for n in tamanhos:
+            proposta = proposta_sintetica(n)
+            diferencas = {}
+            for compacto, caminho in caminhos.items():
+                aplicar_perfil_pdf(compacto)
+                gerar_pdf_proposta(proposta, caminho)
+                diferencas[compacto] = _conferir_texto_referencia(n, caminho)
+            padrao, compacto = (os.path.getsize(c) for c in caminhos.values())
+            log_info(f"{n:5d} parcela(s): {padrao} -> {compacto} bytes ({1 - compacto / padrao:.0%} menor)")
+            for perfil, diferenca in diferencas.items():
+                if diferenca:
+                    iguais = False
+                    log_error(f"{n:5d} parcela(s), perfil {'compacto' if perfil else 'padrão'}: "
+                              f"texto diferente da referência: {diferenca}")
+    finally:
+        aplicar_perfil_pdf(perfil_original)
+        for caminho in caminhos.values():
+            safe_delete_file(caminho)
+    if iguais:
+        log_info("Texto dos PDFs confere com a referência nos dois perfis.")
+    else:
+        log_error("PDF gerado com texto diferente da referência.")
+    return iguais
 
 # ==========================================================
 # LIMPEZA DE PDFs
@@ -845,156 +2464,1677 @@ def limpar_pasta_pdfs_tmp():
         log_warn(f"Falha ao limpar pasta temporária: {e}")
 
 # ==========================================================
-# ROBÔ
+# PERFIL DE DESEMPENHO (CPU / MEMÓRIA)
 # ==========================================================
+# Ligado pela UI ou por SISCOBRA_PERFIL=1. Cada thread da execução roda com seu
+# próprio cProfile (somados no final) e o tracemalloc mede a memória a cada
+# PERFIL_A_CADA_LINHAS linhas (SISCOBRA_PERFIL_A_CADA). Arquivos em APP_DIR:
+#   perfil-<run_id>.prof          abrir com snakeviz / python -m pstats
+#   perfil-<run_id>-alocacoes.txt maiores alocações e o que mais cresceu
+#   perfil-<run_id>-memoria.csv   memória atual e pico ao longo da execução
+
+PERFIL_A_CADA_LINHAS = 50
+
+class PerfilExecucao:
+    def __init__(self, run_id: str, a_cada: int = PERFIL_A_CADA_LINHAS):
+        self.run_id = run_id
+        self.a_cada = max(1, a_cada)
+        self._lock = threading.Lock()
+        self._perfis: List[cProfile.Profile] = []
+        self._local = threading.local()
+        self._linhas = 0
+        self._inicio = 0.0
+        self._memoria: List[Tuple[float, int, int, int]] = []   # (segundos, linhas, atual, pico)
+        self._snap_inicial: Optional[tracemalloc.Snapshot] = None
+        self._snap_ultimo: Optional[tracemalloc.Snapshot] = None
+
+    def iniciar(self):
+        self._inicio = time.monotonic()
+        tracemalloc.start(10)
+        self._snap_inicial = tracemalloc.take_snapshot()
+        self._registrar_memoria()
+        log_info(f"Perfil de desempenho ligado (memória a cada {self.a_cada} linhas).")
+
+    def _registrar_memoria(self):
+        atual, pico = tracemalloc.get_traced_memory()
+        self._memoria.append((time.monotonic() - self._inicio, self._linhas, atual, pico))
+
+    @contextmanager
+    def na_thread(self):
+        # a thread já está sendo perfilada (ex: worker rodando na própria thread do alvo)
+        if getattr(self._local, "ativo", False):
+            yield
+            return
+        prof = cProfile.Profile()
+        with self._lock:
+            self._perfis.append(prof)
+        self._local.ativo = True
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            self._local.ativo = False
+
+    def linha_processada(self):
+        with self._lock:
+            self._linhas += 1
+            if self._linhas % self.a_cada:
+                return
+            self._registrar_memoria()
+            self._snap_ultimo = tracemalloc.take_snapshot()
+
+    def finalizar(self) -> List[str]:
+        base = os.path.join(APP_DIR, f"perfil-{self.run_id}")
+        arquivos: List[str] = []
+        try:
+            with self._lock:
+                self._registrar_memoria()
+                snap_final = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+            stats: Optional[pstats.Stats] = None
+            for prof in self._perfis:
+                if stats is None:
+                    stats = pstats.Stats(prof)
+                else:
+                    stats.add(prof)
+            if stats is not None:
+                stats.dump_stats(base + ".prof")
+                arquivos.append(base + ".prof")
+
+            filtros = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ]
+            snap_final = snap_final.filter_traces(filtros)
+            with open(base + "-alocacoes.txt", "w", encoding="utf-8") as f:
+                f.write(f"Execução {self.run_id} - {self._linhas} linhas\n\n")
+                f.write("Maiores alocações no fim da execução:\n")
+                for st in snap_final.statistics("lineno")[:30]:
+                    f.write(f"{st}\n")
+                if self._snap_inicial is not None:
+                    f.write("\nO que mais cresceu desde o início:\n")
+                    for st in snap_final.compare_to(self._snap_inicial.filter_traces(filtros), "lineno")[:30]:
+                        f.write(f"{st}\n")
+                if self._snap_ultimo is not None:
+                    f.write(f"\nO que mais cresceu desde a última amostra (linha {self._linhas - self._linhas % self.a_cada}):\n")
+                    for st in snap_final.compare_to(self._snap_ultimo.filter_traces(filtros), "lineno")[:15]:
+                        f.write(f"{st}\n")
+            arquivos.append(base + "-alocacoes.txt")
+
+            with open(base + "-memoria.csv", "w", encoding="utf-8") as f:
+                f.write("segundos;linhas;memoria_atual_kb;pico_kb\n")
+                for seg, linhas, atual, pico in self._memoria:
+                    f.write(f"{seg:.1f};{linhas};{atual // 1024};{pico // 1024}\n")
+            arquivos.append(base + "-memoria.csv")
+
+            log_info(f"Perfil de desempenho salvo: {', '.join(arquivos)}")
+        except Exception as e:
+            log_warn(f"Falha ao salvar perfil de desempenho: {e}")
+        return arquivos
 
-def marcar_erro_na_linha(sheets_service, row_number: int, msg: str):
-    try:
-        atualizar_celula(sheets_service, row_number, "E", f"ERRO: {msg}", user_entered=False)
-    except Exception as e:
-        log_error(f"Falha ao escrever erro na planilha (linha {row_number}): {e}")
+PERFIL_ATIVO: Optional[PerfilExecucao] = None
 
-def executar_robo(on_progress: Optional[callable] = None):
-    PROGRESS["running"] = True
-    PROGRESS["processed"] = 0
-    PROGRESS["errors"] = 0
-    PROGRESS["last_message"] = ""
+@contextmanager
+def perfil_thread():
+    """Perfila a thread atual enquanto houver um perfil ligado."""
+    perfil = PERFIL_ATIVO
+    if perfil is None:
+        yield
+        return
+    with perfil.na_thread():
+        yield
 
-    resetar_controles_execucao()
+def com_perfil(fn, *args, **kwargs):
+    """Para threads novas (pool): roda fn dentro de perfil_thread()."""
+    with perfil_thread():
+        return fn(*args, **kwargs)
 
-    carregar_ids_para_globais()
+# ==========================================================
+# RASTREAMENTO POR LINHA (TRACE)
+# ==========================================================
+# Ligado por SISCOBRA_TRACE_PCT (0 a 100, padrão 0): essa porcentagem das
+# linhas é rastreada. Cada linha sorteada vira um trecho com os filhos (SOAP
+# por tentativa, espera entre tentativas, parse, PDF, upload, permissão,
+# escrita na planilha), com a thread e o tamanho dos dados. Linha fora da
+# amostra custa só o sorteio. Arquivo em APP_DIR:
+#   trace-<run_id>.json   formato "trace event" do Chrome: abrir em
+#                         chrome://tracing ou https://ui.perfetto.dev
+
+RASTREIO_MAX_EVENTOS = 500_000   # modo vigiar: para de amostrar depois disso
+
+class RastreioExecucao:
+    def __init__(self, run_id: str, fracao: float):
+        self.run_id = run_id
+        self.fracao = min(1.0, max(0.0, fracao))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._eventos: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._inicio_ns = time.perf_counter_ns()
+        self._pid = os.getpid()
+        self._cheio = False
+        self.linhas = 0
+
+    def _agora_us(self) -> float:
+        return (time.perf_counter_ns() - self._inicio_ns) / 1000
+
+    @contextmanager
+    def linha(self, nome: str, **args):
+        """Trecho raiz de uma linha; sorteia se a linha entra na amostra."""
+        if getattr(self._local, "ativo", False):
+            with self.trecho(nome, **args) as dados:
+                yield dados
+            return
+        if self._cheio or random.random() >= self.fracao:
+            yield None
+            return
+        self._local.ativo = True
+        try:
+            with self.trecho(nome, **args) as dados:
+                yield dados
+        finally:
+            self._local.ativo = False
+            with self._lock:
+                self.linhas += 1
+
+    @contextmanager
+    def trecho(self, nome: str, **args):
+        """
+        Filho do trecho aberto na thread (só grava se a linha foi sorteada).
+        Devolve o dict de args, para acrescentar tamanhos depois de medir.
+        """
+        if not getattr(self._local, "ativo", False):
+            yield None
+            return
+        inicio = self._agora_us()
+        try:
+            yield args
+        except BaseException as e:
+            args["erro"] = type(e).__name__
+            raise
+        finally:
+            fim = self._agora_us()
+            thread = threading.current_thread()
+            evento = {"name": nome, "cat": nome.split(".")[0], "ph": "X", "pid": self._pid,
+                      "tid": thread.ident, "ts": round(inicio, 1), "dur": round(fim - inicio, 1), "args": args}
+            with self._lock:
+                self._threads.setdefault(thread.ident, thread.name)
+                self._eventos.append(evento)
+                if len(self._eventos) >= RASTREIO_MAX_EVENTOS and not self._cheio:
+                    self._cheio = True
+                    log_warn(f"Trace com {RASTREIO_MAX_EVENTOS} eventos; novas linhas não serão rastreadas.")
+
+    def finalizar(self) -> Optional[str]:
+        caminho = os.path.join(APP_DIR, f"trace-{self.run_id}.json")
+        with self._lock:
+            eventos = list(self._eventos)
+            threads = dict(self._threads)
+        nomes = [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": nome}}
+                 for tid, nome in threads.items()]
+        try:
+            with open(caminho, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": nomes + eventos, "displayTimeUnit": "ms",
+                           "otherData": {"run_id": self.run_id, "amostra": self.fracao}}, f, ensure_ascii=False)
+            log_info(f"Trace salvo: {caminho} ({self.linhas} linha(s), {len(eventos)} trechos)")
+            return caminho
+        except Exception as e:
+            log_warn(f"Falha ao salvar trace: {e}")
+            return None
 
-    log_info("Iniciando execução do robô")
-    log_info(f"Pasta do app: {APP_DIR}")
-    log_info(f"Pasta PDFs temporários: {PDF_DIR}")
-    log_info(f"Token: {TOKEN_FILE}")
-    log_info(f"Log: {LOG_FILE}")
-    log_info(f"Spreadsheet: {SPREADSHEET_ID}")
-    log_info(f"Aba: {SHEET_NAME}")
-    log_info(f"Pasta Drive: {DRIVE_FOLDER_ID}")
+RASTREIO_ATIVO: Optional[RastreioExecucao] = None
 
-    limpar_pasta_pdfs_tmp()
+@contextmanager
+def trecho(nome: str, **args):
+    """Trecho filho no trace da linha atual (nada a fazer se o trace está desligado)."""
+    rastreio = RASTREIO_ATIVO
+    if rastreio is None:
+        yield None
+        return
+    with rastreio.trecho(nome, **args) as dados:
+        yield dados
+
+@contextmanager
+def rastrear_linha(nome: str, **args):
+    """Trecho raiz de uma linha, se ela cair na amostra do trace."""
+    rastreio = RASTREIO_ATIVO
+    if rastreio is None:
+        yield None
+        return
+    with rastreio.linha(nome, **args) as dados:
+        yield dados
 
-    data_calc = ultimo_dia_mes()
-    log_info(f"Data de cálculo usada: {data_calc}")
+def iniciar_rastreio(run_id: str):
+    global RASTREIO_ATIVO
+    pct = env_int("SISCOBRA_TRACE_PCT", 0)
+    if pct <= 0:
+        return
+    RASTREIO_ATIVO = RastreioExecucao(run_id, pct / 100)
+    log_info(f"Trace por linha ligado ({min(pct, 100)}% das linhas).")
 
-    sheets_service, drive_service = criar_servicos_google()
+def encerrar_rastreio():
+    global RASTREIO_ATIVO
+    rastreio, RASTREIO_ATIVO = RASTREIO_ATIVO, None
+    if rastreio is not None:
+        rastreio.finalizar()
 
-    # ✅ BLINDA a coluna P
-    garantir_coluna_p_como_texto(sheets_service)
+# ==========================================================
+# AGENDAMENTO (CUSTO HISTÓRICO POR CONTRATO)
+# ==========================================================
 
-    linhas_pendentes = ler_linhas_pendentes(sheets_service)
+class HistoricoContratos:
+    """
+    Custo observado por contrato em execuções anteriores (média móvel):
+    latência SOAP, tamanho da resposta, quantidade de parcelas e tempo de PDF.
+    """
+    PESO_NOVO = 0.5
+    CAMPOS = ("soap_s", "bytes", "parcelas", "pdf_s")
 
-    PROGRESS["total"] = len(linhas_pendentes)
-    if on_progress:
-        on_progress()
+    def __init__(self, caminho: str = HISTORICO_CONTRATOS_FILE):
+        self.caminho = caminho
+        self.dados: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
 
-    if not linhas_pendentes:
-        log_info("Não há linhas pendentes.")
-        PROGRESS["running"] = False
+    def carregar(self) -> "HistoricoContratos":
+        try:
+            if os.path.exists(self.caminho):
+                with open(self.caminho, "r", encoding="utf-8") as f:
+                    self.dados = json.load(f)
+        except Exception as e:
+            log_warn(f"Histórico de contratos ignorado (arquivo inválido): {e}")
+            self.dados = {}
+        return self
+
+    def salvar(self):
+        try:
+            with self._lock:
+                conteudo = json.dumps(self.dados, ensure_ascii=False)
+            tmp = self.caminho + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(conteudo)
+            os.replace(tmp, self.caminho)
+        except Exception as e:
+            log_warn(f"Não consegui salvar histórico de contratos: {e}")
+
+    def registrar(self, contrato: str, medicao: Dict[str, float]):
+        if "soap_s" not in medicao:
+            return  # falhou antes de responder: não diz nada sobre o custo
+        with self._lock:
+            reg = self.dados.get(contrato)
+            if reg is None:
+                reg = {k: float(medicao.get(k, 0.0)) for k in self.CAMPOS}
+                reg["n"] = 0
+            else:
+                for k in self.CAMPOS:
+                    novo = float(medicao.get(k, 0.0))
+                    reg[k] = round(reg.get(k, novo) * (1 - self.PESO_NOVO) + novo * self.PESO_NOVO, 4)
+            reg["n"] = int(reg.get("n", 0)) + 1
+            reg["visto_em"] = date.today().isoformat()
+            self.dados[contrato] = reg
+
+    def custo_estimado(self, contrato: str) -> Optional[float]:
+        reg = self.dados.get(contrato)
+        if not reg:
+            return None
+        return float(reg.get("soap_s", 0.0)) + float(reg.get("pdf_s", 0.0))
+
+def simular_makespan(custos: List[float], workers: int) -> float:
+    """Tempo total se cada tarefa, na ordem dada, for para o primeiro worker livre."""
+    livres = [0.0] * max(1, workers)
+    for c in custos:
+        t = heapq.heappop(livres)
+        heapq.heappush(livres, t + c)
+    return max(livres)
+
+def ordenar_por_custo(linhas: List[LinhaPendente], historico: HistoricoContratos,
+                      workers: int) -> List[LinhaPendente]:
+    """
+    Ordem de processamento: contratos nunca vistos primeiro (podem ser grandes),
+    depois os conhecidos do mais caro para o mais barato, para os workers
+    terminarem juntos. Registra no log o ganho estimado sobre a ordem da planilha.
+    """
+    custos = {id(l): historico.custo_estimado(l.contrato) for l in linhas}
+    conhecidos = [c for c in custos.values() if c is not None]
+    if not conhecidos:
+        return linhas
+
+    novas = [l for l in linhas if custos[id(l)] is None]
+    vistas = sorted((l for l in linhas if custos[id(l)] is not None), key=lambda l: custos[id(l)], reverse=True)
+    ordenadas = novas + vistas
+
+    padrao = statistics.median(conhecidos)
+    def estimativa(l: LinhaPendente) -> float:
+        c = custos[id(l)]
+        return padrao if c is None else c
+
+    antes = simular_makespan([estimativa(l) for l in linhas], workers)
+    depois = simular_makespan([estimativa(l) for l in ordenadas], workers)
+    ganho = (1 - depois / antes) * 100 if antes > 0 else 0.0
+    log_info(
+        f"Agendamento ({workers} workers, {len(conhecidos)}/{len(linhas)} contratos com histórico): "
+        f"tempo estimado na ordem da planilha {antes:.1f}s -> ordem por custo {depois:.1f}s "
+        f"({ganho:.0f}% menor)"
+    )
+    return ordenadas
+
+# ==========================================================
+# RESUMO POR CONDOMÍNIO / ADM
+# ==========================================================
+# Cada proposta processada (enviada ou inalterada) vira uma posição nos arrays
+# colunares abaixo, com os valores em centavos (int64) para somar sem erro de
+# arredondamento. No fim do alvo, np.unique + np.add.at agrupam por
+# (condomínio, ADM, forma) e a aba "Resumo - <aba>" é reescrita com um único
+# spreadsheets.batchUpdate (addSheet, se faltar, + updateCells). Sem reler a
+# planilha e sem fórmula por linha.
+ABA_RESUMO_PREFIXO = "Resumo - "
+CAMPOS_RESUMO = ("principal", "correcao", "juros", "multa", "ho", "total")
+_SEM_DATA_MIN = np.iinfo(np.int64).max
+_SEM_DATA_MAX = 0
+
+def centavos(valor: Decimal) -> int:
+    return int((valor * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+class ResumoExecucao:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chaves: List[str] = []
+        self.valores: Dict[str, List[int]] = {c: [] for c in CAMPOS_RESUMO}
+        self.venc_min: List[int] = []
+        self.venc_max: List[int] = []
+        self.versao = 0   # muda a cada proposta (modo vigiar só reescreve se mudou)
+
+    def adicionar(self, proposta: PropostaAcordo, forma: str):
+        somas = {c: centavos(sum((getattr(p, c) for p in proposta.parcelas), Decimal("0")))
+                 for c in CAMPOS_RESUMO}
+        datas = []
+        for p in proposta.parcelas:
+            if p.vencimento and not parcela_zerada(p):
+                try:
+                    datas.append(datetime.strptime(p.vencimento.strip(), "%d/%m/%Y").date().toordinal())
+                except ValueError:
+                    pass
+        chave = "\x1f".join(((proposta.condominio or "").strip(), (proposta.adm or "").strip(), forma))
+
+        with self._lock:
+            self.chaves.append(chave)
+            for c in CAMPOS_RESUMO:
+                self.valores[c].append(somas[c])
+            self.venc_min.append(min(datas) if datas else _SEM_DATA_MIN)
+            self.venc_max.append(max(datas) if datas else _SEM_DATA_MAX)
+            self.versao += 1
+
+    def agrupar(self) -> List[Dict[str, Any]]:
+        """Um dicionário por (condomínio, ADM, forma), em ordem alfabética."""
+        with self._lock:
+            if not self.chaves:
+                return []
+            chaves = np.array(self.chaves, dtype=object)
+            valores = {c: np.array(v, dtype=np.int64) for c, v in self.valores.items()}
+            venc_min = np.array(self.venc_min, dtype=np.int64)
+            venc_max = np.array(self.venc_max, dtype=np.int64)
+
+        grupos, inv = np.unique(chaves, return_inverse=True)
+        n = len(grupos)
+        quantidade = np.bincount(inv, minlength=n)
+        somas = {}
+        for c, v in valores.items():
+            somas[c] = np.zeros(n, dtype=np.int64)
+            np.add.at(somas[c], inv, v)
+        primeiro = np.full(n, _SEM_DATA_MIN, dtype=np.int64)
+        np.minimum.at(primeiro, inv, venc_min)
+        ultimo = np.full(n, _SEM_DATA_MAX, dtype=np.int64)
+        np.maximum.at(ultimo, inv, venc_max)
+
+        resultado = []
+        for i, grupo in enumerate(grupos):
+            condominio, adm, forma = grupo.split("\x1f")
+            resultado.append({
+                "condominio": condominio,
+                "adm": adm,
+                "forma": forma,
+                "propostas": int(quantidade[i]),
+                **{c: int(somas[c][i]) for c in CAMPOS_RESUMO},
+                "primeiro_vencimento": (date.fromordinal(int(primeiro[i])).strftime("%d/%m/%Y")
+                                        if primeiro[i] != _SEM_DATA_MIN else ""),
+                "ultimo_vencimento": (date.fromordinal(int(ultimo[i])).strftime("%d/%m/%Y")
+                                      if ultimo[i] != _SEM_DATA_MAX else ""),
+            })
+        return resultado
+
+def _celula_texto(valor: str) -> Dict[str, Any]:
+    return {"userEnteredValue": {"stringValue": valor}}
+
+def _celula_numero(valor: int) -> Dict[str, Any]:
+    return {"userEnteredValue": {"numberValue": valor}}
+
+def _celula_moeda(valor_centavos: int) -> Dict[str, Any]:
+    return {
+        "userEnteredValue": {"numberValue": valor_centavos / 100},
+        "userEnteredFormat": {"numberFormat": {"type": "CURRENCY", "pattern": '"R$" #,##0.00'}},
+    }
+
+def escrever_resumo_planilha(sheets_service, alvo: AlvoPlanilha, resumo: ResumoExecucao, data_calc: str):
+    grupos = resumo.agrupar()
+    if not grupos:
         return
+    titulo = f"{ABA_RESUMO_PREFIXO}{alvo.sheet_name}"
 
-    if not check_pause_stop(on_progress):
-        PROGRESS["running"] = False
-        PROGRESS["last_message"] = "Encerrado"
+    LIMITE_SHEETS_LEITURA.aguardar()
+    meta = executar_google(sheets_service.spreadsheets().get(
+        spreadsheetId=alvo.spreadsheet_id,
+        fields="sheets(properties(sheetId,title))"
+    ))
+    abas = {s["properties"]["title"]: s["properties"]["sheetId"] for s in meta.get("sheets", [])}
+
+    cabecalho = ["Condomínio", "ADM", "Forma", "Propostas", "Principal", "Correção", "Juros",
+                 "Multa", "Honorários", "Total", "Primeiro vencimento", "Último vencimento"]
+    linhas = [
+        {"values": [_celula_texto(f"Resumo da execução {RUN_ID} - data de cálculo {data_calc}")]},
+        {"values": [_celula_texto(c) for c in cabecalho]},
+    ]
+    for g in grupos:
+        linhas.append({"values": [
+            _celula_texto(g["condominio"]),
+            _celula_texto(g["adm"]),
+            _celula_texto(g["forma"]),
+            _celula_numero(g["propostas"]),
+            *[_celula_moeda(g[c]) for c in CAMPOS_RESUMO],
+            _celula_texto(g["primeiro_vencimento"]),
+            _celula_texto(g["ultimo_vencimento"]),
+        ]})
+    total_linhas = max(1000, len(linhas))
+
+    requests_body = []
+    sheet_id = abas.get(titulo)
+    if sheet_id is None:
+        sheet_id = int(hashlib.sha1(titulo.encode("utf-8")).hexdigest()[:7], 16)
+        while sheet_id in abas.values():
+            sheet_id += 1
+        requests_body.append({"addSheet": {"properties": {
+            "sheetId": sheet_id,
+            "title": titulo,
+            "gridProperties": {"rowCount": total_linhas, "columnCount": len(cabecalho)},
+        }}})
+    else:
+        requests_body.append({"updateSheetProperties": {
+            "properties": {"sheetId": sheet_id, "gridProperties": {"rowCount": total_linhas}},
+            "fields": "gridProperties.rowCount",
+        }})
+        requests_body.append({"updateCells": {"range": {"sheetId": sheet_id}, "fields": "userEnteredValue"}})
+    requests_body.append({"updateCells": {
+        "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+        "rows": linhas,
+        "fields": "userEnteredValue,userEnteredFormat.numberFormat",
+    }})
+
+    LIMITE_SHEETS_ESCRITA.aguardar()
+    executar_google(sheets_service.spreadsheets().batchUpdate(
+        spreadsheetId=alvo.spreadsheet_id,
+        body={"requests": requests_body}
+    ))
+    log_info(f"[{alvo.rotulo}] Resumo gravado na aba '{titulo}' ({len(grupos)} grupos).")
+
+# ==========================================================
+# SAÍDA GOOGLE (FILA EM DISCO)
+# ==========================================================
+# Com o Sheets/Drive fora do ar ou sem cota, a linha não vira ERRO: os PDFs já
+# gerados e as células a gravar vão para uma fila em disco (SAIDA_GOOGLE_DIR,
+# uma pasta por planilha/aba com <linha>_<contrato>.json + PDFs) e o SOAP e os
+# PDFs das próximas linhas continuam. Depois de uma falha, as linhas vão direto
+# para a fila por GOOGLE_PAUSA_SEG; passado o prazo, a próxima linha testa o
+# Google de novo. Quando ele volta, a fila é entregue em lotes: uploads em
+# paralelo e SAIDA_LOTE_LINHAS linhas por values.batchUpdate. O que sobrar no
+# fim da execução fica para a próxima.
+
+GOOGLE_PAUSA_SEG = 30
+SAIDA_LOTE_LINHAS = 100
+SAIDA_ESPERA_FINAL_SEG = 600   # fim da execução: quanto esperar o Google voltar
+
+@dataclass
+class PdfPendente:
+    forma: str
+    caminho: str
+    nome: str
+    file_id: str     # arquivo já associado à forma (atualizar em vez de criar)
+    hash: str
+    coluna_link: str
+
+def enviar_pdfs(drive_service, alvo: AlvoPlanilha, contrato: str, pdfs: List[PdfPendente],
+                indice_drive: IndicePastaDrive) -> List[Tuple[str, str]]:
+    """Upload dos PDFs da linha. Retorna (file_id, link) de cada um."""
+    links = []
+    for pdf in pdfs:
+        with trecho("drive.enviar", forma=pdf.forma):
+            links.append(indice_drive.enviar(drive_service, pdf.caminho, pdf.nome, pdf.file_id,
+                                             dono=chave_estado_proposta(alvo, contrato, pdf.forma)))
+    return links
+
+def celulas_de_link(pdfs: List[PdfPendente], links: List[Tuple[str, str]]) -> Dict[str, Tuple[str, bool]]:
+    return {pdf.coluna_link: (gsheet_hyperlink(link, pdf.nome), True) for pdf, (_, link) in zip(pdfs, links)}
+
+def concluir_pdfs(estado_propostas: Dict[str, Dict[str, str]], alvo: AlvoPlanilha, contrato: str,
+                  pdfs: List[PdfPendente], links: List[Tuple[str, str]]):
+    """Linha gravada: registra o estado das propostas e apaga os PDFs locais."""
+    for pdf, (file_id, link) in zip(pdfs, links):
+        registrar_estado_proposta(estado_propostas, alvo, contrato, pdf.forma, pdf.hash, file_id, link, pdf.nome)
+        safe_delete_file(pdf.caminho)
+
+def entregar_linha(sheets_service, drive_service, alvo: AlvoPlanilha, contrato: str, row_number: int,
+                   valores: Dict[str, Tuple[str, bool]], pdfs: List[PdfPendente],
+                   indice_drive: IndicePastaDrive, estado_propostas: Dict[str, Dict[str, str]]):
+    """Parte Google de uma linha: upload dos PDFs e gravação de todas as colunas numa chamada."""
+    links = enviar_pdfs(drive_service, alvo, contrato, pdfs, indice_drive)
+    valores = {**valores, **celulas_de_link(pdfs, links)}
+    if valores:
+        atualizar_linha(sheets_service, alvo, row_number, valores)
+    concluir_pdfs(estado_propostas, alvo, contrato, pdfs, links)
+
+class SaidaGoogle:
+    def __init__(self, alvo: AlvoPlanilha):
+        self.alvo = alvo
+        chave = hashlib.sha1(f"{alvo.spreadsheet_id}|{alvo.sheet_name}".encode("utf-8")).hexdigest()[:16]
+        self.pasta = os.path.join(SAIDA_GOOGLE_DIR, chave)
+        self._lock = threading.Lock()
+        self._entregando = threading.Lock()
+        self._linhas: Dict[int, str] = {}   # linha -> contrato
+        self._fora_do_ar_ate = 0.0
+
+    def carregar(self) -> "SaidaGoogle":
+        for _, item in self._itens():
+            self._linhas[item["linha"]] = item["contrato"]
+        if self._linhas:
+            log_info(f"[{self.alvo.rotulo}] {len(self._linhas)} linha(s) na saída do Google de execuções anteriores.")
+        return self
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._linhas)
+
+    def contem(self, linha: LinhaPendente) -> bool:
+        with self._lock:
+            return self._linhas.get(linha.numero) == linha.contrato
+
+    def google_no_ar(self) -> bool:
+        return time.monotonic() >= self._fora_do_ar_ate
+
+    def marcar_fora_do_ar(self, e: BaseException):
+        with self._lock:
+            avisar = self.google_no_ar()
+            self._fora_do_ar_ate = time.monotonic() + GOOGLE_PAUSA_SEG
+        if avisar:
+            log_warn(f"[{self.alvo.rotulo}] Google indisponível ({resumir_erro_usuario(e)}); as linhas seguem "
+                     f"para a saída em disco e o Google é testado de novo em {GOOGLE_PAUSA_SEG}s.")
+
+    def guardar(self, linha: LinhaPendente, valores: Dict[str, Tuple[str, bool]], pdfs: List[PdfPendente]):
+        os.makedirs(self.pasta, exist_ok=True)
+        base = f"{linha.numero}_{sanitize_filename(linha.contrato)}"
+        itens_pdf = []
+        for i, pdf in enumerate(pdfs):
+            destino = os.path.join(self.pasta, f"{base}_{i}.pdf")
+            shutil.move(pdf.caminho, destino)
+            itens_pdf.append({**asdict(pdf), "caminho": os.path.basename(destino)})
+        item = {
+            "linha": linha.numero,
+            "contrato": linha.contrato,
+            "valores": {col: [valor, user_entered] for col, (valor, user_entered) in valores.items()},
+            "pdfs": itens_pdf,
+            "guardado_em": datetime.now().isoformat(timespec="seconds"),
+        }
+        caminho = os.path.join(self.pasta, base + ".json")
+        with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(item, f, ensure_ascii=False)
+        os.replace(caminho + ".tmp", caminho)
+        with self._lock:
+            self._linhas[linha.numero] = linha.contrato
+        log_warn(f"[{self.alvo.rotulo}] Linha {linha.numero} (contrato {linha.contrato}) guardada na saída "
+                 f"do Google ({len(pdfs)} PDF(s)).")
+
+    def _itens(self) -> List[Tuple[str, Dict[str, Any]]]:
+        if not os.path.isdir(self.pasta):
+            return []
+        itens = []
+        for nome in os.listdir(self.pasta):
+            if not nome.endswith(".json"):
+                continue
+            caminho = os.path.join(self.pasta, nome)
+            try:
+                with open(caminho, "r", encoding="utf-8") as f:
+                    itens.append((caminho, json.load(f)))
+            except Exception as e:
+                log_warn(f"Item ilegível na saída do Google ({caminho}): {e}")
+        itens.sort(key=lambda x: x[1]["linha"])
+        return itens
+
+    def _descartar(self, caminho: str, item: Dict[str, Any]):
+        for pdf in item["pdfs"]:
+            safe_delete_file(os.path.join(self.pasta, pdf["caminho"]))
+        safe_delete_file(caminho)
+        with self._lock:
+            if self._linhas.get(item["linha"]) == item["contrato"]:
+                del self._linhas[item["linha"]]
+
+    def entregar(self, clientes: PoolClientesGoogle, indice_drive: IndicePastaDrive,
+                 estado_propostas: Dict[str, Dict[str, str]]) -> int:
+        """Entrega a fila se o Google estiver no ar. Retorna quantas linhas foram gravadas."""
+        if not len(self) or not self.google_no_ar():
+            return 0
+        if not self._entregando.acquire(blocking=False):
+            return 0   # outra thread já está entregando
+        entregues = 0
+        try:
+            sheets_service, _ = clientes.servicos()
+            # a planilha pode ter mudado durante a queda: só grava onde o contrato continua o mesmo
+            contratos = baixar_colunas(sheets_service, self.alvo, ["C"])["C"]
+            itens = []
+            for caminho, item in self._itens():
+                i = item["linha"] - 2
+                if not (0 <= i < len(contratos) and contratos[i].strip() == item["contrato"]):
+                    log_warn(f"[{self.alvo.rotulo}] Linha {item['linha']} não tem mais o contrato "
+                             f"{item['contrato']}; descartada da saída do Google.")
+                    self._descartar(caminho, item)
+                    continue
+                pdfs = [PdfPendente(**{**p, "caminho": os.path.join(self.pasta, p["caminho"])}) for p in item["pdfs"]]
+                itens.append((caminho, item, pdfs))
+
+            def enviar(par: Tuple[Dict[str, Any], List[PdfPendente]]) -> List[Tuple[str, str]]:
+                return enviar_pdfs(clientes.servicos()[1], self.alvo, par[0]["contrato"], par[1], indice_drive)
+
+            with ThreadPoolExecutor(max_workers=self.alvo.linhas_simultaneas,
+                                    thread_name_prefix=f"alvo-{self.alvo.indice}-saida") as pool:
+                for inicio in range(0, len(itens), SAIDA_LOTE_LINHAS):
+                    if STOP_EVENT.is_set():
+                        break
+                    lote = itens[inicio:inicio + SAIDA_LOTE_LINHAS]
+                    links = list(pool.map(enviar, [(item, pdfs) for _, item, pdfs in lote]))
+                    por_linha = {
+                        item["linha"]: {**{col: (v, u) for col, (v, u) in item["valores"].items()},
+                                        **celulas_de_link(pdfs, lk)}
+                        for (_, item, pdfs), lk in zip(lote, links)
+                    }
+                    atualizar_linhas(sheets_service, self.alvo, por_linha)
+                    for (caminho, item, pdfs), lk in zip(lote, links):
+                        concluir_pdfs(estado_propostas, self.alvo, item["contrato"], pdfs, lk)
+                        self._descartar(caminho, item)
+                    entregues += len(lote)
+        except ExecucaoEncerrada:
+            raise
+        except Exception as e:
+            if google_indisponivel(e):
+                self.marcar_fora_do_ar(e)
+            else:
+                log_error(f"[{self.alvo.rotulo}] Falha ao entregar a saída do Google: {e}")
+                logging.exception(e)
+        finally:
+            self._entregando.release()
+
+        if entregues:
+            log_info(f"[{self.alvo.rotulo}] Saída do Google: {entregues} linha(s) gravada(s), {len(self)} na fila.")
+        return entregues
+
+    def esvaziar(self, clientes: PoolClientesGoogle, indice_drive: IndicePastaDrive,
+                 estado_propostas: Dict[str, Dict[str, str]], espera_max: float = SAIDA_ESPERA_FINAL_SEG):
+        """Fim da execução: entrega a fila, esperando o Google voltar por até espera_max segundos."""
+        limite = time.monotonic() + espera_max
+        while len(self) and not STOP_EVENT.is_set():
+            self.entregar(clientes, indice_drive, estado_propostas)
+            # sobrou item com o Google no ar: falha que não passa esperando
+            if not len(self) or self.google_no_ar() or time.monotonic() >= limite:
+                break
+            PROGRESS["last_message"] = f"{self.alvo.rotulo}: aguardando o Google ({len(self)} linha(s) na saída)"
+            dormir(max(0.0, self._fora_do_ar_ate - time.monotonic()))
+        if len(self):
+            log_warn(f"[{self.alvo.rotulo}] {len(self)} linha(s) continuam na saída do Google "
+                     f"({self.pasta}); serão gravadas na próxima execução.")
+
+# ==========================================================
+# FALHAS TRANSITÓRIAS (REFAZER)
+# ==========================================================
+# Toda linha que recebe ERRO fica registrada em FALHAS_LINHAS_FILE com a classe
+# do erro: "transitoria" (timeout, rede, cota, servidor fora do ar) ou
+# "permanente" (XML inválido, contrato sem dados...). Depois da passada
+# principal, as transitórias desta execução e as de execuções anteriores
+# (achadas na mesma leitura da planilha) são refeitas em rodadas, com uma
+# espera antes de cada uma (REFAZER_ESPERAS_SEG). Sucesso grava o link por
+# cima do ERRO; erro permanente nunca é refeito. Depois de
+# FALHAS_MAX_TENTATIVAS falhas do mesmo contrato, a falha vira permanente.
+
+REFAZER_ESPERAS_SEG = (30, 120, 300)
+FALHAS_MAX_TENTATIVAS = 5
+
+class FalhasLinhas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.falhas: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _chave(alvo: AlvoPlanilha, numero: int) -> str:
+        return f"{alvo.spreadsheet_id}|{alvo.sheet_name}|{numero}"
+
+    def carregar(self) -> "FalhasLinhas":
+        try:
+            with open(FALHAS_LINHAS_FILE, "r", encoding="utf-8") as f:
+                falhas = json.load(f)
+        except FileNotFoundError:
+            falhas = {}
+        except Exception as e:
+            log_warn(f"Não consegui ler o registro de falhas ({e}); começando vazio.")
+            falhas = {}
+        with self._lock:
+            self.falhas = falhas
+        return self
+
+    def _salvar(self):
+        try:
+            with self._lock:
+                dados = json.dumps(self.falhas, ensure_ascii=False)
+            with open(FALHAS_LINHAS_FILE + ".tmp", "w", encoding="utf-8") as f:
+                f.write(dados)
+            os.replace(FALHAS_LINHAS_FILE + ".tmp", FALHAS_LINHAS_FILE)
+        except Exception as e:
+            log_warn(f"Não consegui gravar o registro de falhas: {e}")
+
+    def registrar(self, alvo: AlvoPlanilha, linha: LinhaPendente, e: BaseException) -> str:
+        """Registra o ERRO gravado na linha. Retorna a classe."""
+        classe = "transitoria" if erro_transitorio(e) else "permanente"
+        if alvo.simulado:
+            return classe
+        chave = self._chave(alvo, linha.numero)
+        with self._lock:
+            anterior = self.falhas.get(chave)
+            tentativas = 1
+            if anterior and anterior.get("contrato") == linha.contrato:
+                tentativas = anterior.get("tentativas", 0) + 1
+            if tentativas >= FALHAS_MAX_TENTATIVAS:
+                classe = "permanente"
+            self.falhas[chave] = {
+                "contrato": linha.contrato,
+                "classe": classe,
+                "erro": resumir_erro_usuario(e),
+                "tentativas": tentativas,
+                "quando": datetime.now().isoformat(timespec="seconds"),
+            }
+        self._salvar()
+        return classe
+
+    def resolver(self, alvo: AlvoPlanilha, numero: int):
+        if alvo.simulado:
+            return
+        with self._lock:
+            removida = self.falhas.pop(self._chave(alvo, numero), None)
+        if removida is not None:
+            self._salvar()
+
+    def classe(self, alvo: AlvoPlanilha, numero: int) -> str:
+        with self._lock:
+            return self.falhas.get(self._chave(alvo, numero), {}).get("classe", "")
+
+    def transitorias(self, alvo: AlvoPlanilha) -> Dict[int, str]:
+        """{linha: contrato} das falhas transitórias registradas para a planilha/aba."""
+        prefixo = f"{alvo.spreadsheet_id}|{alvo.sheet_name}|"
+        with self._lock:
+            return {int(chave[len(prefixo):]): f["contrato"] for chave, f in self.falhas.items()
+                    if chave.startswith(prefixo) and f.get("classe") == "transitoria"}
+
+FALHAS_LINHAS = FalhasLinhas()
+
+def refazer_transitorias(alvo: AlvoPlanilha, clientes: PoolClientesGoogle, linhas: List[LinhaPendente],
+                         data_calc: str, estado_propostas: Dict[str, Dict[str, str]],
+                         indice_drive: IndicePastaDrive, resumo: ResumoExecucao, saida: SaidaGoogle,
+                         contadas_como_erro: set, on_progress: Optional[callable] = None):
+    """
+    Rodadas de REFAZER_ESPERAS_SEG com as linhas de falha transitória.
+    contadas_como_erro: linhas que já entraram no contador de erros desta execução
+    (as de execuções anteriores só contam como erro se continuarem falhando).
+    """
+    for rodada, espera in enumerate(REFAZER_ESPERAS_SEG, start=1):
+        if not linhas or STOP_EVENT.is_set():
+            break
+        log_info(f"[{alvo.rotulo}] {len(linhas)} linha(s) com falha transitória; rodada "
+                 f"{rodada}/{len(REFAZER_ESPERAS_SEG)} em {espera}s.")
+        PROGRESS["last_message"] = f"{alvo.rotulo}: refazendo {len(linhas)} linha(s) em {espera}s"
+        if on_progress:
+            on_progress()
+        dormir(espera)
+
+        def refazer(linha: LinhaPendente) -> str:
+            sheets_w, drive_w = clientes.servicos()
+            return processar_linha(sheets_w, drive_w, alvo, linha, data_calc, estado_propostas,
+                                   on_progress, None, indice_drive, resumo, saida)
+
+        with ThreadPoolExecutor(max_workers=alvo.linhas_simultaneas,
+                                thread_name_prefix=f"alvo-{alvo.indice}-refazer") as pool:
+            resultados = list(pool.map(lambda l: com_perfil(refazer, l), linhas))
+
+        falharam = []
+        for linha, status in zip(linhas, resultados):
+            if status in ("ok", "saida"):
+                incrementar_progresso("processed")
+                if linha.numero in contadas_como_erro:
+                    contadas_como_erro.discard(linha.numero)
+                    incrementar_progresso("errors", -1)
+            elif status == "erro" and FALHAS_LINHAS.classe(alvo, linha.numero) == "transitoria":
+                falharam.append(linha)
+        log_info(f"[{alvo.rotulo}] Rodada {rodada}: {len(linhas) - len(falharam)} linha(s) refeita(s), "
+                 f"{len(falharam)} ainda com falha transitória.")
+        if on_progress:
+            on_progress()
+        linhas = falharam
+
+    if linhas and not STOP_EVENT.is_set():
+        incrementar_progresso("errors", sum(1 for l in linhas if l.numero not in contadas_como_erro))
+        log_warn(f"[{alvo.rotulo}] {len(linhas)} linha(s) continuam com ERRO transitório; "
+                 f"serão refeitas na próxima execução.")
+
+# ==========================================================
+# ROBÔ
+# ==========================================================
+
+def marcar_erro_na_linha(sheets_service, alvo: AlvoPlanilha, row_number: int, msg: str,
+                         colunas: Optional[List[str]] = None):
+    """Escreve "ERRO: <msg>" na coluna de link (E) ou nas colunas informadas."""
+    try:
+        valores = {col: (f"ERRO: {msg}", False) for col in (colunas or ["E"])}
+        atualizar_linha(sheets_service, alvo, row_number, valores)
+    except Exception as e:
+        log_error(f"Falha ao escrever erro na planilha (linha {row_number}): {e}")
+
+def montar_vencimentos(proposta: PropostaAcordo) -> str:
+    """Faixa "primeiro a último" vencimento para a coluna P (mesma regra do PDF: ignora parcelas zeradas)."""
+    datas_venc: List[str] = []
+    for p in proposta.parcelas:
+        if not p.vencimento:
+            continue
+        if parcela_zerada(p):
+            continue
+        datas_venc.append(p.vencimento.strip())
+
+    try:
+        datas_dt = [datetime.strptime(d, "%d/%m/%Y").date() for d in datas_venc]
+        primeira = min(datas_dt).strftime("%d/%m/%Y")
+        ultima = max(datas_dt).strftime("%d/%m/%Y")
+        return f"'{primeira} a {ultima}"  # texto (não aparece o ')
+    except Exception:
+        return ""
+
+def total_proposta(proposta: PropostaAcordo) -> Decimal:
+    """Mesmo valor da linha "Total" do PDF (soma de todas as parcelas)."""
+    return sum((p.total for p in proposta.parcelas), Decimal("0"))
+
+def celulas_de_valores(forma: FormaAlvo, proposta: PropostaAcordo, total_geral: Decimal,
+                       cpf_terceiro: str) -> Dict[str, Tuple[str, bool]]:
+    """Valor e vencimentos da forma e nome/CPF do terceiro (Q/R), como vão para a planilha."""
+    return {
+        forma.coluna_valor: (f"{br_money(total_geral)} ({valor_por_extenso_ptbr(total_geral)})", False),
+        forma.coluna_vencimentos: (montar_vencimentos(proposta), True),  # ✅ importante
+        # REGRA: nome terceiro em MAIÚSCULO
+        COLUNA_NOME_TERCEIRO: ((proposta.cliente or "").strip().upper(), False),
+        COLUNA_CPF_TERCEIRO: (cpf_terceiro, False),
+    }
+
+def processar_linha(sheets_service, drive_service, alvo: AlvoPlanilha, linha: LinhaPendente, data_calc: str,
+                    estado_propostas: Dict[str, Dict[str, str]],
+                    on_progress: Optional[callable] = None,
+                    medicao: Optional[Dict[str, float]] = None,
+                    indice_drive: Optional[IndicePastaDrive] = None,
+                    resumo: Optional[ResumoExecucao] = None,
+                    saida: Optional[SaidaGoogle] = None) -> str:
+    """
+    Processa uma linha: uma chamada SOAP e, para cada forma de negociação
+    pendente, PDF + upload. Todas as colunas da linha são gravadas juntas
+    no final. Retorna "ok", "inalterada", "saida", "erro" ou "parado".
+    medicao (opcional) recebe soap_s, bytes, parcelas e pdf_s para o histórico.
+    indice_drive: índice da pasta do alvo; sem ele, cada PDF vai como arquivo novo.
+    resumo (opcional) recebe as propostas gravadas ou inalteradas.
+    saida (opcional): com o Google fora do ar, a linha vai para a saída em disco
+    em vez de virar ERRO.
+    """
+    with rastrear_linha("linha", planilha=alvo.rotulo, linha=linha.numero, contrato=linha.contrato) as rastro:
+        status = _processar_linha(sheets_service, drive_service, alvo, linha, data_calc, estado_propostas,
+                                  on_progress, medicao, indice_drive, resumo, saida)
+        if rastro is not None:
+            rastro["status"] = status
+    if status in ("ok", "saida", "inalterada"):
+        FALHAS_LINHAS.resolver(alvo, linha.numero)
+    return status
+
+def _processar_linha(sheets_service, drive_service, alvo: AlvoPlanilha, linha: LinhaPendente, data_calc: str,
+                     estado_propostas: Dict[str, Dict[str, str]],
+                     on_progress: Optional[callable],
+                     medicao: Optional[Dict[str, float]],
+                     indice_drive: Optional[IndicePastaDrive],
+                     resumo: Optional[ResumoExecucao],
+                     saida: Optional[SaidaGoogle]) -> str:
+    if medicao is None:
+        medicao = {}
+    if indice_drive is None:
+        indice_drive = IndicePastaDrive(alvo)
+    contrato = linha.contrato
+    row_number = linha.numero
+    caminhos_pdf: List[str] = []
+    # no modo recalcular, forma que já tem link nunca recebe ERRO por cima do link
+    colunas_sem_link = [f.coluna_link for f in linha.formas if not link_preenchido(linha.celula(f.coluna_link))]
+    try:
+        PROGRESS["last_message"] = f"{alvo.rotulo}: contrato {contrato} (linha {row_number})"
         if on_progress:
             on_progress()
-        log_info("Execução encerrada antes de iniciar o processamento.")
-        return
 
-    for row_number, row_values, contrato, cpf_planilha_bruto in linhas_pendentes:
         if not check_pause_stop(on_progress):
-            log_warn("Execução encerrada pelo usuário.")
-            break
+            return "parado"
 
-        caminho_pdf = ""
-        try:
-            PROGRESS["last_message"] = f"Processando contrato {contrato} (linha {row_number})"
-            if on_progress:
-                on_progress()
+        xml_inner = chamar_ws_com_retry(TOKEN, data_calc, contrato, medicao=medicao)
 
-            if not check_pause_stop(on_progress):
-                break
+        if not check_pause_stop(on_progress):
+            return "parado"
 
-            xml_inner = chamar_ws_com_retry(TOKEN, data_calc, contrato)
+        inicio_parse = time.monotonic()
+        with trecho("parse.propostas", formas=len(linha.formas)):
+            propostas = extrair_propostas(xml_inner, [f.nome for f in linha.formas], data_calc)
+        medicao["parse_s"] = medicao.get("parse_s", 0.0) + time.monotonic() - inicio_parse
+        medicao["parcelas"] = sum(len(p.parcelas) for p in propostas.values())
+        medicao["pdf_s"] = 0.0
 
-            if not check_pause_stop(on_progress):
-                break
+        cpf_digits = somente_digitos(linha.cpf_planilha)
+        cpf_terceiro = "-" if not cpf_digits else formatar_cpf_cnpj(linha.cpf_planilha)
+
+        valores: Dict[str, Tuple[str, bool]] = {}
+        pdfs: List[PdfPendente] = []
+        para_resumo: List[Tuple[PropostaAcordo, str]] = []
+        inalteradas = 0
+        parado = False
+
+        for forma in linha.formas:
+            proposta = propostas[forma.nome]
+            ja_vinculada = link_preenchido(linha.celula(forma.coluna_link))
 
-            proposta = extrair_proposta(xml_inner, FORMA_NEGOCIACAO_ALVO, data_calc)
             if not proposta.parcelas:
-                PROGRESS["errors"] += 1
-                marcar_erro_na_linha(sheets_service, row_number, "Sem parcelas (30% HO)")
-                log_warn(f"Contrato {contrato}: sem parcelas na forma 30% HO")
+                log_warn(f"Contrato {contrato}: sem parcelas na forma {forma.nome}")
+                if not ja_vinculada:
+                    valores[forma.coluna_link] = (f"ERRO: Sem parcelas ({forma.nome})", False)
                 continue
 
-            cpf_digits = somente_digitos(cpf_planilha_bruto)
-            proposta.cpf_cnpj = cpf_planilha_bruto.strip() if cpf_digits else ""
+            proposta.cpf_cnpj = linha.cpf_planilha.strip() if cpf_digits else ""
+
+            hash_atual = hash_proposta(proposta)
+            registro = estado_propostas.get(chave_estado_proposta(alvo, contrato, forma.nome))
 
-            nome_pdf = montar_nome_pdf(proposta, contrato)
-            caminho_pdf = os.path.join(PDF_DIR, nome_pdf)
+            if ja_vinculada and registro and registro.get("hash") == hash_atual:
+                inalteradas += 1
+                para_resumo.append((proposta, forma.nome))
+                log_info(f"Contrato {contrato} (linha {row_number}, {forma.nome}): proposta sem alteração, nada a enviar.")
+                continue
+
+            sufixo_forma = "" if forma == alvo.formas[0] else forma.nome
+            nome_pdf = montar_nome_pdf(proposta, contrato, sufixo_forma)
+            # nome local curto e único: alvos diferentes podem gerar o mesmo nome de PDF ao mesmo tempo
+            caminho_pdf = os.path.join(PDF_DIR, f"{alvo.indice}_{row_number}_{len(caminhos_pdf)}.pdf")
+            caminhos_pdf.append(caminho_pdf)
 
-            total_geral = gerar_pdf_proposta(proposta, caminho_pdf)
+            inicio_pdf = time.monotonic()
+            with trecho("pdf", forma=forma.nome, parcelas=len(proposta.parcelas)) as rastro:
+                total_geral = gerar_pdf_proposta(proposta, caminho_pdf)
+                tamanho_pdf = METRICAS_PDF.gerado(caminho_pdf)
+                if rastro is not None:
+                    rastro["bytes"] = tamanho_pdf
+            medicao["pdf_s"] += time.monotonic() - inicio_pdf
 
             if not check_pause_stop(on_progress):
+                parado = True
                 break
 
-            link_pdf = upload_pdf_para_drive(drive_service, caminho_pdf, nome_pdf)
+            # forma já vinculada: atualiza o mesmo arquivo no Drive em vez de criar outro
+            file_id = registro.get("file_id", "") if (ja_vinculada and registro) else ""
+            pdfs.append(PdfPendente(forma=forma.nome, caminho=caminho_pdf, nome=nome_pdf, file_id=file_id,
+                                    hash=hash_atual, coluna_link=forma.coluna_link))
 
+            valores.update(celulas_de_valores(forma, proposta, total_geral, cpf_terceiro))
+            para_resumo.append((proposta, forma.nome))
+
+        # Google fora do ar: PDFs e células vão para a saída em disco (SaidaGoogle)
+        guardada = False
+        if valores or pdfs:
+            if saida is not None and not saida.google_no_ar():
+                guardada = True
+            else:
+                try:
+                    entregar_linha(sheets_service, drive_service, alvo, contrato, row_number,
+                                   valores, pdfs, indice_drive, estado_propostas)
+                except Exception as e:
+                    if saida is None or not google_indisponivel(e):
+                        raise
+                    saida.marcar_fora_do_ar(e)
+                    guardada = True
+            if guardada:
+                saida.guardar(linha, valores, pdfs)
+        if resumo is not None:
+            for proposta, forma_nome in para_resumo:
+                resumo.adicionar(proposta, forma_nome)
+
+        if parado:
+            return "parado"
+        if guardada:
+            return "saida"
+        if pdfs:
+            return "ok"
+        if inalteradas:
+            return "inalterada"
+        return "erro"  # nenhuma forma com parcelas
+
+    except ExecucaoEncerrada:
+        for caminho_pdf in caminhos_pdf:
             safe_delete_file(caminho_pdf)
-            caminho_pdf = ""
+        log_warn(f"[{alvo.rotulo}] Linha {row_number} (contrato {contrato}) interrompida pelo encerramento.")
+        return "parado"
 
-            link_cell_value = gsheet_hyperlink(link_pdf, nome_pdf)
-            valor_coluna_o = f"{br_money(total_geral)} ({valor_por_extenso_ptbr(total_geral)})"
+    except Exception as e:
+        for caminho_pdf in caminhos_pdf:
+            safe_delete_file(caminho_pdf)
 
-            # ✅ VENCIMENTOS: usa a MESMA REGRA do PDF (ignora parcelas zeradas)
-            datas_venc: List[str] = []
-            for p in proposta.parcelas:
-                if not p.vencimento:
-                    continue
-                if parcela_zerada(p):
-                    continue
-                datas_venc.append(p.vencimento.strip())
+        erro_claro = resumir_erro_usuario(e)
+        classe = "transitoria" if erro_transitorio(e) else "permanente"
+        if colunas_sem_link:
+            marcar_erro_na_linha(sheets_service, alvo, row_number, erro_claro, colunas_sem_link)
+            classe = FALHAS_LINHAS.registrar(alvo, linha, e)
+
+        log_error(f"[{alvo.rotulo}] Falha ao processar linha {row_number} (contrato {contrato}) [{classe}]: {e}")
+        logging.exception(e)
+        return "erro"
+
+def executar_linha(sheets_service, drive_service, alvo: AlvoPlanilha, linha: LinhaPendente, data_calc: str,
+                   estado_propostas: Dict[str, Dict[str, str]],
+                   historico: HistoricoContratos,
+                   indice_drive: IndicePastaDrive,
+                   resumo: ResumoExecucao,
+                   on_progress: Optional[callable] = None,
+                   saida: Optional[SaidaGoogle] = None) -> str:
+    """processar_linha + histórico de custo, perfil e contadores de progresso."""
+    medicao: Dict[str, float] = {}
+    status = processar_linha(sheets_service, drive_service, alvo, linha, data_calc,
+                             estado_propostas, on_progress, medicao, indice_drive, resumo, saida)
+    if status == "parado":
+        return status
+
+    historico.registrar(linha.contrato, medicao)
+    if PERFIL_ATIVO is not None:
+        PERFIL_ATIVO.linha_processada()
+
+    incrementar_progresso("errors" if status == "erro" else "processed")
+    registrar_primeira_linha()
+    if on_progress:
+        on_progress()
+    return status
 
-            vencimentos_str = ""
+def executar_alvo(alvo: AlvoPlanilha, clientes: PoolClientesGoogle, data_calc: str,
+                  estado_propostas: Dict[str, Dict[str, str]],
+                  historico: HistoricoContratos,
+                  recalcular_vinculadas: bool = False,
+                  on_progress: Optional[callable] = None) -> int:
+    """
+    Processa as linhas pendentes de uma planilha/aba com alvo.linhas_simultaneas
+    workers, na ordem dada por ordenar_por_custo. Retorna quantas propostas
+    estavam inalteradas.
+    """
+    log_info(f"Spreadsheet: {alvo.spreadsheet_id}")
+    log_info(f"Aba: {alvo.sheet_name}")
+    log_info(f"Pasta Drive: {alvo.drive_folder_id}")
+    log_info(f"Formas de negociação: {', '.join(f.nome for f in alvo.formas)}")
+
+    sheets_service, drive_service = clientes.servicos()
+    inicio = time.monotonic()
+
+    # Em paralelo com a leitura da planilha: formato TEXT das colunas de
+    # vencimento (✅ BLINDA a coluna P) e índice da pasta do Drive. Cada thread
+    # usa o seu próprio cliente Google.
+    preparo = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"alvo-{alvo.indice}-prep")
+    f_texto = preparo.submit(lambda: garantir_coluna_p_como_texto(clientes.servicos()[0], alvo))
+    f_indice = preparo.submit(lambda: IndicePastaDrive(alvo, estado_propostas).carregar(clientes.servicos()[1]))
+    preparo.shutdown(wait=False)
+
+    resumo = ResumoExecucao()
+    saida = SaidaGoogle(alvo).carregar()
+    indice_drive: Optional[IndicePastaDrive] = None
+    workers = alvo.linhas_simultaneas
+    fila: "queue.Queue[LinhaPendente]" = queue.Queue()
+    leitura_concluida = threading.Event()
+
+    inalteradas = [0]
+    # falhas transitórias (desta execução e ERRO de execuções anteriores): refeitas no fim
+    refazer = FALHAS_LINHAS.transitorias(alvo)
+    a_refazer: List[LinhaPendente] = []
+    contadas_como_erro: set = set()
+    contadores_lock = threading.Lock()
+
+    def worker(n: int):
+        threading.current_thread().name = f"alvo-{alvo.indice}-w{n}"
+        servicos = None
+
+        while True:
+            if not check_pause_stop(on_progress):
+                return
             try:
-                datas_dt = [datetime.strptime(d, "%d/%m/%Y").date() for d in datas_venc]
-                primeira = min(datas_dt).strftime("%d/%m/%Y")
-                ultima = max(datas_dt).strftime("%d/%m/%Y")
-                vencimentos_str = f"'{primeira} a {ultima}"  # texto (não aparece o ')
-            except Exception:
-                vencimentos_str = ""
-
-            # REGRA: nome terceiro em MAIÚSCULO
-            nome_terceiro = (proposta.cliente or "").strip().upper()
-            cpf_terceiro = "-" if not cpf_digits else formatar_cpf_cnpj(cpf_planilha_bruto)
-
-            atualizar_celula(sheets_service, row_number, "E", link_cell_value, user_entered=True)
-            atualizar_celula(sheets_service, row_number, "O", valor_coluna_o)
-            atualizar_celula(sheets_service, row_number, "P", vencimentos_str, user_entered=True)  # ✅ importante
-            atualizar_celula(sheets_service, row_number, "Q", nome_terceiro)
-            atualizar_celula(sheets_service, row_number, "R", cpf_terceiro)
+                linha = fila.get(timeout=ESPERA_ENCERRAR_SEG)
+            except queue.Empty:
+                if leitura_concluida.is_set() and fila.empty():
+                    return
+                continue
 
-            PROGRESS["processed"] += 1
+            if servicos is None:
+                # cliente Google próprio por worker (httplib2 não é thread-safe)
+                servicos = clientes.servicos()
+            sheets_w, drive_w = servicos
+            status = executar_linha(sheets_w, drive_w, alvo, linha, data_calc,
+                                    estado_propostas, historico, indice_drive, resumo, on_progress, saida)
+            if status == "parado":
+                return
+            if status == "inalterada":
+                with contadores_lock:
+                    inalteradas[0] += 1
+            if status == "erro" and FALHAS_LINHAS.classe(alvo, linha.numero) == "transitoria":
+                with contadores_lock:
+                    a_refazer.append(linha)
+                    contadas_como_erro.add(linha.numero)
+            if status == "ok" and len(saida):
+                saida.entregar(clientes, indice_drive, estado_propostas)   # o Google voltou
+
+    # Os workers começam assim que chega o primeiro bloco com linhas pendentes;
+    # o resto da planilha continua sendo lido enquanto isso.
+    pool: Optional[ThreadPoolExecutor] = None
+    futuros = []
+    total = 0
+    try:
+        for bloco in ler_pendentes_em_blocos(sheets_service, alvo, incluir_vinculadas=recalcular_vinculadas,
+                                             drive_service=drive_service, refazer=refazer):
+            # linha esperando na saída do Google não volta para o SOAP
+            bloco = [l for l in bloco if not saida.contem(l)]
+            anteriores = [l for l in bloco if l.com_erro()]
+            if anteriores:
+                bloco = [l for l in bloco if not l.com_erro()]
+                incrementar_progresso("total", len(anteriores))
+                with contadores_lock:
+                    a_refazer.extend(anteriores)
+            if not bloco:
+                continue
+            if pool is None:
+                aguardar_futuro(f_texto)
+                indice_drive = aguardar_futuro(f_indice)
+                pool = ThreadPoolExecutor(max_workers=workers)
+                futuros = [pool.submit(com_perfil, worker, n) for n in range(1, workers + 1)]
+
+            total += len(bloco)
+            incrementar_progresso("total", len(bloco))
             if on_progress:
                 on_progress()
+            for linha in ordenar_por_custo(bloco, historico, workers):
+                fila.put(linha)
+    finally:
+        leitura_concluida.set()
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    if pool is None and not a_refazer:
+        aguardar_futuro(f_texto)  # aba inexistente ainda aparece como erro do alvo
+        if len(saida) and not STOP_EVENT.is_set():
+            saida.esvaziar(clientes, aguardar_futuro(f_indice), estado_propostas)
+        if on_progress:
+            on_progress()
+        log_info(f"[{alvo.rotulo}] Não há linhas pendentes.")
+        return 0
+    for futuro in futuros:
+        futuro.result()
+    if indice_drive is None:
+        aguardar_futuro(f_texto)
+        indice_drive = aguardar_futuro(f_indice)
+
+    if len(saida) and not STOP_EVENT.is_set():
+        saida.esvaziar(clientes, indice_drive, estado_propostas)
+    if a_refazer and not STOP_EVENT.is_set():
+        refazer_transitorias(alvo, clientes, a_refazer, data_calc, estado_propostas, indice_drive,
+                             resumo, saida, contadas_como_erro, on_progress)
+        if len(saida) and not STOP_EVENT.is_set():
+            saida.esvaziar(clientes, indice_drive, estado_propostas)
 
+    if STOP_EVENT.is_set():
+        log_warn(f"[{alvo.rotulo}] Execução encerrada pelo usuário.")
+    else:
+        try:
+            escrever_resumo_planilha(sheets_service, alvo, resumo, data_calc)
         except Exception as e:
-            safe_delete_file(caminho_pdf)
+            log_warn(f"[{alvo.rotulo}] Não consegui gravar a aba de resumo: {e}")
+
+    log_info(f"[{alvo.rotulo}] Planilha concluída em {time.monotonic() - inicio:.1f}s "
+             f"({total} linhas, {workers} workers).")
+    return inalteradas[0]
+
+# Modo vigiar: fica rodando, relendo a planilha de tempos em tempos, e joga
+# cada linha nova direto na fila dos workers. Os clientes SOAP/Google ficam
+# abertos entre as leituras. O intervalo cai para o mínimo quando aparecem
+# linhas e dobra a cada leitura vazia, até o máximo. Com a planilha parada,
+# cada leitura custa só a consulta de versão no Drive (ler_valores_em_blocos).
+VIGIAR_INTERVALO_MIN_SEG = 5
+VIGIAR_INTERVALO_MAX_SEG = 120
+VIGIAR_IGNORAR_RECENTES_SEG = 600   # linha já processada não volta para a fila nesse prazo
+
+def vigiar_alvo(alvo: AlvoPlanilha, clientes: PoolClientesGoogle,
+                estado_propostas: Dict[str, Dict[str, str]],
+                historico: HistoricoContratos,
+                on_progress: Optional[callable] = None) -> int:
+    """
+    Modo vigiar de uma planilha/aba: alvo.linhas_simultaneas workers fixos
+    consumindo a fila, e esta thread lendo a planilha até o usuário encerrar.
+    Retorna 0 (não há modo recalcular aqui).
+    """
+    intervalo_min = env_int("SISCOBRA_VIGIAR_MIN", VIGIAR_INTERVALO_MIN_SEG)
+    intervalo_max = max(intervalo_min, env_int("SISCOBRA_VIGIAR_MAX", VIGIAR_INTERVALO_MAX_SEG))
+    log_info(f"[{alvo.rotulo}] Modo vigiar: planilha relida a cada {intervalo_min}s a {intervalo_max}s.")
+
+    sheets_service, drive_service = clientes.servicos()
+    garantir_coluna_p_como_texto(sheets_service, alvo)
+    indice_drive = IndicePastaDrive(alvo, estado_propostas).carregar(drive_service)
+    resumo = ResumoExecucao()
+    saida = SaidaGoogle(alvo).carregar()
+    versao_resumo_gravada = 0
+
+    fila: "queue.Queue[Tuple[LinhaPendente, str]]" = queue.Queue()
+    lock = threading.Lock()
+    em_andamento: set = set()               # na fila ou em processamento
+    recentes: Dict[Tuple[int, str], float] = {}   # concluídas -> monotonic
+    fim = threading.Event()                 # poller saiu (encerrar ou falha)
+
+    def worker(n: int):
+        if alvo.linhas_simultaneas > 1:
+            threading.current_thread().name = f"alvo-{alvo.indice}-w{n}"
+        sheets_w, drive_w = clientes.servicos()
+
+        while not fim.is_set() and check_pause_stop(on_progress):
+            try:
+                linha, data_calc = fila.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            chave = (linha.numero, linha.contrato)
+            try:
+                executar_linha(sheets_w, drive_w, alvo, linha, data_calc,
+                               estado_propostas, historico, indice_drive, resumo, on_progress, saida)
+            except Exception as e:
+                log_error(f"[{alvo.rotulo}] Falha inesperada na linha {linha.numero}: {e}")
+                logging.exception(e)
+            finally:
+                with lock:
+                    em_andamento.discard(chave)
+                    recentes[chave] = time.monotonic()
+
+    pool = ThreadPoolExecutor(max_workers=alvo.linhas_simultaneas)
+    for n in range(1, alvo.linhas_simultaneas + 1):
+        pool.submit(com_perfil, worker, n)
+
+    intervalo = intervalo_min
+    data_calc = ""
+    try:
+        while check_pause_stop(on_progress):
+            nova_data = ultimo_dia_mes()
+            if nova_data != data_calc:
+                data_calc = nova_data
+                log_info(f"[{alvo.rotulo}] Data de cálculo usada: {data_calc}")
+
+            try:
+                # ERRO transitório volta para a fila; VIGIAR_IGNORAR_RECENTES_SEG é a espera
+                pendentes = ler_linhas_pendentes(sheets_service, alvo, drive_service=drive_service,
+                                                 silencioso=True, refazer=FALHAS_LINHAS.transitorias(alvo))
+            except ExecucaoEncerrada:
+                break
+            except Exception as e:
+                log_warn(f"[{alvo.rotulo}] Falha ao ler a planilha ({e}); tentando de novo em {intervalo_max}s.")
+                STOP_EVENT.wait(intervalo_max)
+                continue
 
-            PROGRESS["errors"] += 1
-            erro_claro = resumir_erro_usuario(e)
-            marcar_erro_na_linha(sheets_service, row_number, erro_claro)
+            agora = time.monotonic()
+            with lock:
+                for chave, quando in list(recentes.items()):
+                    if agora - quando > VIGIAR_IGNORAR_RECENTES_SEG:
+                        del recentes[chave]
+                novas = [l for l in pendentes
+                         if (l.numero, l.contrato) not in em_andamento
+                         and (l.numero, l.contrato) not in recentes
+                         and not saida.contem(l)]
+                em_andamento.update((l.numero, l.contrato) for l in novas)
+
+            if novas:
+                log_info(f"[{alvo.rotulo}] {len(novas)} linha(s) nova(s) na fila.")
+                incrementar_progresso("total", len(novas))
+                for linha in ordenar_por_custo(novas, historico, alvo.linhas_simultaneas):
+                    fila.put((linha, data_calc))
+                historico.salvar()
+                intervalo = intervalo_min
+            else:
+                intervalo = min(intervalo * 2, intervalo_max)
 
-            log_error(f"Falha ao processar linha {row_number} (contrato {contrato}): {e}")
-            logging.exception(e)
+            try:
+                saida.entregar(clientes, indice_drive, estado_propostas)
+            except ExecucaoEncerrada:
+                break
 
+            # fila vazia: atualiza a aba de resumo com o que foi processado até aqui
+            with lock:
+                ocioso = not em_andamento
+            versao_resumo = resumo.versao
+            if ocioso and versao_resumo != versao_resumo_gravada:
+                try:
+                    escrever_resumo_planilha(sheets_service, alvo, resumo, data_calc)
+                    versao_resumo_gravada = versao_resumo
+                except ExecucaoEncerrada:
+                    break
+                except Exception as e:
+                    log_warn(f"[{alvo.rotulo}] Não consegui gravar a aba de resumo: {e}")
+
+            PROGRESS["last_message"] = f"Vigiando {alvo.rotulo} (próxima leitura em {intervalo}s)"
             if on_progress:
                 on_progress()
+            STOP_EVENT.wait(intervalo)
+    finally:
+        fim.set()
+        pool.shutdown(wait=True)
+
+    log_warn(f"[{alvo.rotulo}] Modo vigiar encerrado pelo usuário.")
+    return 0
+
+# Modo só valores (python main.py --valores --linhas 2-500 --filtro A=ADM*):
+# regrava valor e vencimentos de cada forma (O/P na forma principal), nome (Q)
+# e CPF (R) das linhas escolhidas, sem PDF e sem Drive: SOAP, extração e
+# gravação em lotes de VALORES_LOTE_LINHAS linhas por values.batchUpdate.
+# As linhas vêm da faixa e/ou do filtro (com ou sem link); a coluna de link
+# não é tocada e falha de uma linha só vai para o log.
+VALORES_LOTE_LINHAS = 100
+
+def interpretar_faixas(texto: str) -> List[Tuple[int, Optional[int]]]:
+    """ "2-500,731,900-" -> [(2, 500), (731, 731), (900, None)]: None vai até a última linha. """
+    faixas = []
+    for parte in (texto or "").split(","):
+        parte = parte.strip()
+        if not parte:
             continue
+        ini, traco, fim = (p.strip() for p in parte.partition("-"))
+        try:
+            a = int(ini)
+            b = int(fim) if fim else (None if traco else a)
+        except ValueError:
+            raise ValueError(f"Faixa de linhas inválida: {parte}") from None
+        if a < 2 or (b is not None and b < a):
+            raise ValueError(f"Faixa de linhas inválida: {parte}")
+        faixas.append((a, b))
+    return faixas
+
+def interpretar_filtros(textos: List[str]) -> List[Tuple[str, str]]:
+    """ ["A=ADM*"] -> [("A", "ADM*")]: coluna e padrão (curingas * e ?, sem diferenciar maiúsculas). """
+    filtros = []
+    for texto in textos or []:
+        coluna, sep, padrao = texto.partition("=")
+        coluna = coluna.strip().upper()
+        if not sep or not re.fullmatch(r"[A-Z]{1,3}", coluna):
+            raise ValueError(f"Filtro inválido (use COLUNA=PADRÃO): {texto}")
+        filtros.append((coluna, padrao.strip().upper()))
+    return filtros
+
+def ler_linhas_selecionadas(sheets_service, alvo: AlvoPlanilha, faixas: List[Tuple[int, Optional[int]]],
+                            filtros: List[Tuple[str, str]]) -> List[LinhaPendente]:
+    """Linhas com ID e contrato dentro das faixas e que batem com todos os filtros (todas as formas)."""
+    cols = sorted({"A", "C", ULTIMA_COLUNA_BASE} | {c for c, _ in filtros}, key=coluna_para_indice)
+    primeira = min(a for a, _ in faixas) if faixas else 2
+    ultima = None if not faixas or any(b is None for _, b in faixas) else max(b for _, b in faixas)
+    colunas = baixar_colunas(sheets_service, alvo, cols, primeira, ultima)
+    largura = coluna_para_indice(cols[-1]) + 1
+
+    linhas: List[LinhaPendente] = []
+    for numero, row in enumerate(_montar_linhas(colunas, largura), start=primeira):
+        if faixas and not any(a <= numero and (b is None or numero <= b) for a, b in faixas):
+            continue
+        id_linha, contrato = row[0].strip(), row[2].strip()
+        if not id_linha or id_linha == "-" or not contrato or contrato == "-":
+            continue
+        if not all(fnmatch.fnmatchcase(row[coluna_para_indice(c)].strip().upper(), padrao) for c, padrao in filtros):
+            continue
+        linhas.append(LinhaPendente(numero=numero, valores=row, contrato=contrato,
+                                    cpf_planilha=row[coluna_para_indice(ULTIMA_COLUNA_BASE)].strip(),
+                                    formas=list(alvo.formas)))
+    return linhas
+
+def valores_da_linha(alvo: AlvoPlanilha, linha: LinhaPendente, data_calc: str) -> Dict[str, Tuple[str, bool]]:
+    """SOAP + extração de uma linha no modo só valores: as células a gravar."""
+    with rastrear_linha("linha", planilha=alvo.rotulo, linha=linha.numero, contrato=linha.contrato):
+        xml_inner = chamar_ws_com_retry(TOKEN, data_calc, linha.contrato)
+        with trecho("parse.propostas", formas=len(linha.formas)):
+            propostas = extrair_propostas(xml_inner, [f.nome for f in linha.formas], data_calc)
+
+    cpf_digits = somente_digitos(linha.cpf_planilha)
+    cpf_terceiro = "-" if not cpf_digits else formatar_cpf_cnpj(linha.cpf_planilha)
+    valores: Dict[str, Tuple[str, bool]] = {}
+    for forma in linha.formas:
+        proposta = propostas[forma.nome]
+        if not proposta.parcelas:
+            log_warn(f"Contrato {linha.contrato}: sem parcelas na forma {forma.nome}")
+            continue
+        valores.update(celulas_de_valores(forma, proposta, total_proposta(proposta), cpf_terceiro))
+    return valores
+
+def executar_valores_alvo(alvo: AlvoPlanilha, clientes: PoolClientesGoogle, data_calc: str,
+                          faixas: List[Tuple[int, Optional[int]]], filtros: List[Tuple[str, str]],
+                          on_progress: Optional[callable] = None) -> int:
+    """Modo só valores de uma planilha/aba. Retorna quantas linhas foram gravadas."""
+    sheets_service, _ = clientes.servicos()
+    garantir_coluna_p_como_texto(sheets_service, alvo)
+    linhas = ler_linhas_selecionadas(sheets_service, alvo, faixas, filtros)
+    log_info(f"[{alvo.rotulo}] {len(linhas)} linha(s) selecionada(s) para atualizar os valores.")
+    incrementar_progresso("total", len(linhas))
+
+    gravadas = 0
+    lote: Dict[int, Dict[str, Tuple[str, bool]]] = {}
+
+    def gravar_lote():
+        nonlocal gravadas, lote
+        if lote:
+            atualizar_linhas(sheets_service, alvo, lote)
+            gravadas += len(lote)
+            lote = {}
+
+    with ThreadPoolExecutor(max_workers=alvo.linhas_simultaneas,
+                            thread_name_prefix=f"alvo-{alvo.indice}-valores") as pool:
+        futuros = {pool.submit(com_perfil, valores_da_linha, alvo, linha, data_calc): linha for linha in linhas}
+        try:
+            for futuro in as_completed(futuros):
+                linha = futuros[futuro]
+                try:
+                    valores = futuro.result()
+                except ExecucaoEncerrada:
+                    continue
+                except Exception as e:
+                    log_error(f"[{alvo.rotulo}] Falha ao calcular os valores da linha {linha.numero} "
+                              f"(contrato {linha.contrato}): {resumir_erro_usuario(e)}")
+                    incrementar_progresso("errors")
+                    continue
+                if valores:
+                    lote[linha.numero] = valores
+                incrementar_progresso("processed")
+                if on_progress:
+                    on_progress()
+                if len(lote) >= VALORES_LOTE_LINHAS:
+                    gravar_lote()
+        finally:
+            # parada ou falha na gravação: não espera os SOAP que ainda estão na fila
+            for futuro in futuros:
+                futuro.cancel()
+    gravar_lote()   # o que já foi calculado é gravado mesmo se a execução foi encerrada
+    return gravadas
+
+def executar_so_valores(faixas: List[Tuple[int, Optional[int]]], filtros: List[Tuple[str, str]],
+                        on_progress: Optional[callable] = None):
+    """Modo só valores em todos os alvos do ids-google.json, um depois do outro."""
+    global RUN_ID
+    RUN_ID = novo_run_id()
+    PROGRESS.update({"running": True, "total": 0, "processed": 0, "errors": 0, "last_message": ""})
+    resetar_controles_execucao()
+    marcar_inicio_execucao()
+    HEDGE_SOAP.iniciar_execucao()
+    log_info(f"Modo só valores ({RUN_ID}): linhas {faixas or 'todas'}, filtros {filtros or 'nenhum'}")
+
+    aquecer_conexoes_soap()
+    alvos = carregar_alvos()
+    clientes = PoolClientesGoogle(obter_credenciais_google()).iniciar()
+    data_calc = ultimo_dia_mes()
+    log_info(f"Data de cálculo usada: {data_calc}")
+    iniciar_rastreio(RUN_ID)
+
+    inicio = time.monotonic()
+    gravadas = 0
+    try:
+        for alvo in alvos:
+            if not check_pause_stop(on_progress):
+                break
+            try:
+                gravadas += executar_valores_alvo(alvo, clientes, data_calc, faixas, filtros, on_progress)
+            except ExecucaoEncerrada:
+                break
+            except Exception as e:
+                log_error(f"[{alvo.rotulo}] Falha geral na planilha: {e}")
+                logging.exception(e)
+    finally:
+        clientes.fechar()
+        encerrar_rastreio()
+        PROGRESS["running"] = False
+
+    decorrido = time.monotonic() - inicio
+    log_info(f"Modo só valores concluído: {gravadas} linha(s) gravada(s), {PROGRESS['errors']} erro(s), "
+             f"{decorrido:.1f}s ({1000 * decorrido / max(1, gravadas):.0f} ms/linha).")
+
+def executar_robo(on_progress: Optional[callable] = None, recalcular_vinculadas: bool = False,
+                  perfil: bool = False, vigiar: bool = False):
+    """
+    Processa todos os alvos do ids-google.json. Com mais de um alvo, cada planilha
+    roda na sua thread, compartilhando credenciais Google, sessão SOAP e limites de taxa.
+
+    recalcular_vinculadas: modo recalcular. Também busca as linhas que já têm link
+    e só gera/reenvia o PDF quando o hash da proposta mudou (atualizando o mesmo
+    arquivo no Drive). Linha sem alteração custa só a chamada SOAP.
+
+    perfil (ou SISCOBRA_PERFIL=1): grava relatórios de CPU e memória da execução em APP_DIR.
+
+    vigiar: não termina ao esvaziar a planilha; continua relendo e processando
+    as linhas novas até o usuário encerrar (vigiar_alvo).
+    """
+    global RUN_ID, PERFIL_ATIVO
+    RUN_ID = novo_run_id()
+
+    if not (perfil or env_ativo("SISCOBRA_PERFIL")):
+        _executar_robo(on_progress, recalcular_vinculadas, vigiar)
+        return
+
+    PERFIL_ATIVO = PerfilExecucao(RUN_ID, env_int("SISCOBRA_PERFIL_A_CADA", PERFIL_A_CADA_LINHAS))
+    PERFIL_ATIVO.iniciar()
+    try:
+        with perfil_thread():
+            _executar_robo(on_progress, recalcular_vinculadas, vigiar)
+    finally:
+        perfil_fim, PERFIL_ATIVO = PERFIL_ATIVO, None
+        perfil_fim.finalizar()
+
+def _executar_robo(on_progress: Optional[callable], recalcular_vinculadas: bool, vigiar: bool = False):
+    PROGRESS["running"] = True
+    PROGRESS["total"] = 0
+    PROGRESS["processed"] = 0
+    PROGRESS["errors"] = 0
+    PROGRESS["last_message"] = ""
+
+    resetar_controles_execucao()
+    marcar_inicio_execucao()
+    HEDGE_SOAP.iniciar_execucao()
+    METRICAS_PDF.zerar()
+
+    log_info(f"Iniciando execução do robô ({RUN_ID})")
+    log_info(f"Pasta do app: {APP_DIR}")
+    log_info(f"Pasta PDFs temporários: {PDF_DIR}")
+    log_info(f"Token: {TOKEN_FILE}")
+    log_info(f"Log: {LOG_FILE}")
+
+    # Arranque em paralelo: configuração, limpeza dos PDFs temporários,
+    # credenciais Google e arquivos locais não dependem um do outro. As
+    # conexões com o Siscobra abrem em segundo plano enquanto isso.
+    inicio_arranque = time.monotonic()
+    aquecer_conexoes_soap()
+    with ThreadPoolExecutor(max_workers=6, thread_name_prefix="arranque") as arranque:
+        f_alvos = arranque.submit(carregar_alvos)
+        f_limpeza = arranque.submit(limpar_pasta_pdfs_tmp)
+        f_creds = arranque.submit(obter_credenciais_google)
+        f_estado = arranque.submit(carregar_estado_propostas)
+        f_historico = arranque.submit(lambda: HistoricoContratos().carregar())
+        f_falhas = arranque.submit(FALHAS_LINHAS.carregar)
+    alvos = f_alvos.result()
+    f_limpeza.result()
+    clientes = PoolClientesGoogle(f_creds.result()).iniciar()
+    estado_propostas = f_estado.result()
+    historico = f_historico.result()
+    f_falhas.result()
+    log_info(f"Arranque concluído em {time.monotonic() - inicio_arranque:.2f}s.")
+
+    log_info(f"Planilhas nesta execução: {len(alvos)}")
+    if vigiar and recalcular_vinculadas:
+        log_warn("Modo recalcular não vale no modo vigiar; só linhas sem link serão processadas.")
+        recalcular_vinculadas = False
+    if recalcular_vinculadas:
+        log_info("Modo recalcular: linhas com link serão conferidas pelo hash da proposta.")
+    if vigiar:
+        log_info("Modo vigiar: o robô continua rodando até ser encerrado.")
+
+    data_calc = ultimo_dia_mes()
+    log_info(f"Data de cálculo usada: {data_calc}")
+
+    if not check_pause_stop(on_progress):
+        PROGRESS["running"] = False
+        PROGRESS["last_message"] = "Encerrado"
+        if on_progress:
+            on_progress()
+        log_info("Execução encerrada antes de iniciar o processamento.")
+        clientes.fechar()
+        return
+
+    iniciar_gravacao_soap()
+    iniciar_rastreio(RUN_ID)
+
+    def rodar_alvo(alvo: AlvoPlanilha) -> int:
+        try:
+            if vigiar:
+                return vigiar_alvo(alvo, clientes, estado_propostas, historico, on_progress)
+            return executar_alvo(alvo, clientes, data_calc, estado_propostas, historico,
+                                 recalcular_vinculadas, on_progress)
+        except ExecucaoEncerrada:
+            log_warn(f"[{alvo.rotulo}] Execução encerrada pelo usuário.")
+            return 0
+
+    inalteradas = 0
+    try:
+        if len(alvos) == 1:
+            inalteradas = rodar_alvo(alvos[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(alvos), thread_name_prefix="alvo") as pool:
+                futuros = {pool.submit(com_perfil, rodar_alvo, alvo): alvo for alvo in alvos}
+                for futuro in as_completed(futuros):
+                    alvo = futuros[futuro]
+                    try:
+                        inalteradas += futuro.result()
+                    except Exception as e:
+                        # falha de um alvo (ex: aba não encontrada) não derruba os outros
+                        log_error(f"[{alvo.rotulo}] Falha geral na planilha: {e}")
+                        logging.exception(e)
+    finally:
+        clientes.fechar()
+        historico.salvar()
+        encerrar_gravacao_soap()
+        encerrar_rastreio()
+        log_info(METRICAS_PDF.resumo())
+        if HEDGE_SOAP.ativo:
+            log_info(HEDGE_SOAP.resumo())
 
     if STOP_EVENT.is_set():
-        limpar_pasta_pdfs_tmp()
+        # limpeza em segundo plano: o encerramento não espera o disco (e o que
+        # sobrar é apagado no início da próxima execução)
+        threading.Thread(target=limpar_pasta_pdfs_tmp, name="limpeza-pdfs", daemon=True).start()
         PROGRESS["running"] = False
         PROGRESS["last_message"] = "Encerrado"
         if on_progress:
@@ -1004,6 +4144,9 @@ def executar_robo(on_progress: Optional[callable] = None):
 
     limpar_pasta_pdfs_tmp()
 
+    if recalcular_vinculadas:
+        log_info(f"Propostas sem alteração (não reenviadas): {inalteradas}")
+
     PROGRESS["running"] = False
     PROGRESS["last_message"] = "Finalizado"
     if on_progress:
@@ -1016,7 +4159,8 @@ def executar_robo(on_progress: Optional[callable] = None):
 # ==========================================================
 
 def iniciar_robo_thread(lbl_total: tk.Label, lbl_proc: tk.Label, lbl_err: tk.Label, lbl_msg: tk.Label,
-                        botao_iniciar: tk.Button, botao_pausar: tk.Button, botao_encerrar: tk.Button):
+                        botao_iniciar: tk.Button, botao_pausar: tk.Button, botao_encerrar: tk.Button,
+                        recalcular_vinculadas: bool = False, perfil: bool = False, vigiar: bool = False):
 
     def update_ui():
         total = PROGRESS.get("total", 0)
@@ -1038,7 +4182,12 @@ def iniciar_robo_thread(lbl_total: tk.Label, lbl_proc: tk.Label, lbl_err: tk.Lab
             PROGRESS["last_message"] = "Iniciando..."
             lbl_msg.after(0, update_ui)
 
-            executar_robo(on_progress=lambda: lbl_msg.after(0, update_ui))
+            executar_robo(
+                on_progress=lambda: lbl_msg.after(0, update_ui),
+                recalcular_vinculadas=recalcular_vinculadas,
+                perfil=perfil,
+                vigiar=vigiar,
+            )
 
             lbl_msg.after(0, update_ui)
 
@@ -1067,7 +4216,7 @@ def iniciar_robo_thread(lbl_total: tk.Label, lbl_proc: tk.Label, lbl_err: tk.Lab
 def criar_ui():
     root = tk.Tk()
     root.title("Robô Proposta de Acordo")
-    root.geometry("700x340")
+    root.geometry("700x420")
 
     titulo = tk.Label(root, text="Robô Proposta de Acordo", font=("Arial", 14, "bold"))
     titulo.pack(pady=10)
@@ -1092,6 +4241,33 @@ def criar_ui():
     lbl_msg = tk.Label(root, text="Status: aguardando...", font=("Arial", 10))
     lbl_msg.pack(pady=10)
 
+    recalcular_var = tk.BooleanVar(value=False)
+    chk_recalcular = tk.Checkbutton(
+        root,
+        text="Recalcular linhas que já têm link (reenvia só o que mudou)",
+        variable=recalcular_var,
+        font=("Arial", 9),
+    )
+    chk_recalcular.pack(pady=2)
+
+    perfil_var = tk.BooleanVar(value=env_ativo("SISCOBRA_PERFIL"))
+    chk_perfil = tk.Checkbutton(
+        root,
+        text="Gerar relatório de desempenho (CPU e memória) desta execução",
+        variable=perfil_var,
+        font=("Arial", 9),
+    )
+    chk_perfil.pack(pady=2)
+
+    vigiar_var = tk.BooleanVar(value=False)
+    chk_vigiar = tk.Checkbutton(
+        root,
+        text="Modo vigiar: continuar rodando e processar linhas novas assim que aparecerem",
+        variable=vigiar_var,
+        font=("Arial", 9),
+    )
+    chk_vigiar.pack(pady=2)
+
     frame_botoes = tk.Frame(root)
     frame_botoes.pack(pady=10)
 
@@ -1122,7 +4298,9 @@ def criar_ui():
     botao_encerrar.grid(row=0, column=2, padx=6)
 
     def on_click_iniciar():
-        iniciar_robo_thread(lbl_total, lbl_proc, lbl_err, lbl_msg, botao_iniciar, botao_pausar, botao_encerrar)
+        iniciar_robo_thread(lbl_total, lbl_proc, lbl_err, lbl_msg, botao_iniciar, botao_pausar, botao_encerrar,
+                            recalcular_vinculadas=recalcular_var.get(), perfil=perfil_var.get(),
+                            vigiar=vigiar_var.get())
 
     def on_click_pausar():
         if PAUSE_EVENT.is_set():
@@ -1150,7 +4328,76 @@ def criar_ui():
 # MAIN
 # ==========================================================
 
-if __name__ == "__main__":
+def vigiar_sem_interface():
+    """Modo vigiar pelo terminal. Ctrl+C pede o encerramento e espera os workers."""
+    t = threading.Thread(target=executar_robo, kwargs={"vigiar": True}, name="robo")
+    t.start()
+    while t.is_alive():
+        try:
+            t.join(0.5)
+        except KeyboardInterrupt:
+            log_info("Ctrl+C: encerrando o modo vigiar...")
+            solicitar_encerrar()
+
+def valores_sem_interface(faixas: List[Tuple[int, Optional[int]]], filtros: List[Tuple[str, str]]):
+    """Modo só valores pelo terminal. Ctrl+C pede o encerramento e grava o que já foi calculado."""
+    t = threading.Thread(target=executar_so_valores, args=(faixas, filtros), name="robo")
+    t.start()
+    while t.is_alive():
+        try:
+            t.join(0.5)
+        except KeyboardInterrupt:
+            log_info("Ctrl+C: encerrando o modo só valores...")
+            solicitar_encerrar()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Robô Proposta de Acordo")
+    parser.add_argument("--replay", metavar="CAPTURA",
+                        help="roda parse/PDF/upload falso com uma captura SOAP (.sqlite) em vez da rede")
+    parser.add_argument("--workers", type=int, default=1, help="workers no replay (padrão: 1)")
+    parser.add_argument("--benchmark-pdf", action="store_true",
+                        help="mede a geração do PDF com 10, 100, 1.000 e 5.000 parcelas")
+    parser.add_argument("--verificar-pdf", action="store_true",
+                        help="confere o texto do PDF (perfis padrão e compacto) com a referência")
+    parser.add_argument("--valores", action="store_true",
+                        help="só valores: atualiza valor, vencimentos, nome e CPF (O-R) sem PDF nem Drive")
+    parser.add_argument("--linhas", metavar="FAIXAS", default="",
+                        help="--valores: linhas a atualizar, ex: 2-500,731,900- (900 até a última)")
+    parser.add_argument("--filtro", metavar="COLUNA=PADRÃO", action="append", default=[],
+                        help="--valores: só linhas em que a coluna bate com o padrão (ex: A=ADM*); pode repetir")
+    parser.add_argument("--vigiar", action="store_true",
+                        help="sem interface: fica processando linhas novas até Ctrl+C")
+    args = parser.parse_args(argv)
+
     os.makedirs(APP_DIR, exist_ok=True)
     os.makedirs(PDF_DIR, exist_ok=True)
+
+    if args.replay:
+        executar_replay(args.replay, workers=args.workers)
+        return
+
+    if args.benchmark_pdf:
+        benchmark_pdf()
+        return
+
+    if args.verificar_pdf:
+        sys.exit(0 if verificar_pdf_compacto() else 1)
+
+    if args.valores:
+        try:
+            faixas, filtros = interpretar_faixas(args.linhas), interpretar_filtros(args.filtro)
+        except ValueError as e:
+            parser.error(str(e))
+        if not faixas and not filtros:
+            parser.error("--valores precisa de --linhas e/ou --filtro")
+        valores_sem_interface(faixas, filtros)
+        return
+
+    if args.vigiar:
+        vigiar_sem_interface()
+        return
+
     criar_ui()
+
+if __name__ == "__main__":
+    main()